@@ -12,13 +12,20 @@ from torch.autograd import Variable
 
 # samplers
 import mjrl.samplers.core as trajectory_sampler
+from mjrl.samplers.async_sampler import AsyncSampler
 
 # utility functions
 import mjrl.utils.process_samples as process_samples
+from mjrl.utils import path_batch
+from mjrl.utils.path_batch import PathBatch
 from mjrl.utils.logger import DataLog
+from mjrl.utils.fisher import GaussianFisher
 
 
 class BatchREINFORCE:
+    # outputs of the old policy for the current update (see cache_old_dist_info)
+    _old_dist_cache = ()
+
     def __init__(self, env, policy, baseline,
                  learn_rate=0.01,
                  seed=123,
@@ -37,20 +44,138 @@ class BatchREINFORCE:
         self.desired_kl = desired_kl
         if save_logs: self.logger = DataLog()
 
+    def cache_old_dist_info(self, observations, actions, old_dist_info=None):
+        # The old policy is fixed during an update, so its outputs on the batch are computed once
+        # and reused by all the calls that get these same observations and actions arrays.
+        # old_dist_info can be given if already known (e.g. rows of another cached batch).
+        if old_dist_info is None:
+            with torch.no_grad():
+                old_dist_info = self.policy.old_dist_info(observations, actions)
+        self._old_dist_cache = self._old_dist_cache + ((observations, actions, old_dist_info),)
+
+    def clear_old_dist_info(self):
+        # has to be called before the old policy is changed
+        self._old_dist_cache = ()
+
+    def old_dist_info(self, observations, actions, idx=None):
+        """
+        :param observations:    observations of the batch (same object as given to cache_old_dist_info to use the cache)
+        :param actions:         actions of the batch
+        :param idx:             optional indices of the samples to use (of observations and actions)
+        """
+        for cached_obs, cached_act, (LL, mean, log_std) in self._old_dist_cache:
+            if observations is cached_obs and actions is cached_act:
+                return [LL, mean, log_std] if idx is None else [LL[idx], mean[idx], log_std]
+        if idx is not None:
+            observations, actions = observations[idx], actions[idx]
+        return self.policy.old_dist_info(observations, actions)
+
     def CPI_surrogate(self, observations, actions, advantages):
         adv_var = Variable(torch.from_numpy(advantages).float(), requires_grad=False)
-        old_dist_info = self.policy.old_dist_info(observations, actions)
+        old_dist_info = self.old_dist_info(observations, actions)
         new_dist_info = self.policy.new_dist_info(observations, actions)
         LR = self.policy.likelihood_ratio(new_dist_info, old_dist_info)
         surr = torch.mean(LR*adv_var)
         return surr
 
     def kl_old_new(self, observations, actions):
-        old_dist_info = self.policy.old_dist_info(observations, actions)
+        old_dist_info = self.old_dist_info(observations, actions)
         new_dist_info = self.policy.new_dist_info(observations, actions)
         mean_kl = self.policy.mean_kl(new_dist_info, old_dist_info)
         return mean_kl
 
+    def evaluate_surrogate(self, observations, actions, advantages, compute_grad=False):
+        """
+        CPI surrogate, mean KL to the old policy and likelihood ratios from a single forward pass
+        of the policy (the outputs of the old policy come from the cache, see cache_old_dist_info).
+        :param compute_grad:    also compute the gradient of the surrogate (as flat_vpg)
+        :return:                dict with surr, kl, LR (per sample, numpy) and grad (None if not computed)
+        """
+        adv_var = Variable(torch.from_numpy(advantages).float(), requires_grad=False)
+        old_dist_info = self.old_dist_info(observations, actions)
+        with torch.enable_grad() if compute_grad else torch.no_grad():
+            new_dist_info = self.policy.new_dist_info(observations, actions)
+            LR = self.policy.likelihood_ratio(new_dist_info, old_dist_info)
+            surr = torch.mean(LR*adv_var)
+            mean_kl = self.policy.mean_kl(new_dist_info, old_dist_info)
+        vpg_grad = None
+        if compute_grad:
+            vpg_grad = torch.autograd.grad(surr, self.policy.trainable_params)
+            vpg_grad = np.concatenate([g.contiguous().view(-1).data.numpy() for g in vpg_grad])
+        return dict(surr=surr.item(), kl=mean_kl.item(), LR=LR.data.numpy(), grad=vpg_grad)
+
+    def batched_surrogate_kl(self, observations, actions, advantages, candidate_params):
+        """
+        CPI surrogate and mean KL (to the old policy) of several parameter vectors, evaluated with
+        one batched forward pass of the mean network (the parameters of the policy are not changed).
+        :param candidate_params:    array (K, d) of flat parameter vectors (layout of policy.get_param_values())
+        :return:                    surrogates (K,) and KLs (K,) as numpy arrays
+        """
+        model = self.policy.model
+        K = candidate_params.shape[0]
+        with torch.no_grad():
+            params = torch.from_numpy(np.float32(candidate_params))
+            splits = torch.split(params, [int(size) for size in self.policy.param_sizes], dim=1)
+            obs = torch.from_numpy(np.float32(observations))
+            act = torch.from_numpy(np.float32(actions))
+            adv = torch.from_numpy(np.float32(advantages))
+            # mean for every candidate: (K, N, m)
+            out = (obs - model.in_shift) / (model.in_scale + 1e-8)
+            num_layers = len(model.fc_layers)
+            out = out.expand(K, *out.shape)
+            for i in range(num_layers):
+                W = splits[2*i].view(K, *self.policy.param_shapes[2*i])
+                b = splits[2*i+1]
+                out = torch.baddbmm(b[:, None, :], out, W.transpose(1, 2))
+                if i < num_layers - 1:
+                    out = model.nonlinearity(out)
+            mean = out * model.out_scale + model.out_shift
+            # log_std is clamped as in set_param_values: (K, 1, m)
+            log_std = torch.clamp(splits[-1], min=self.policy.min_log_std)[:, None, :]
+            LL_old, old_mean, old_log_std = self.old_dist_info(observations, actions)
+            zs = (act - mean) / torch.exp(log_std)
+            LL = - 0.5 * torch.sum(zs ** 2, dim=2) + \
+                 - torch.sum(log_std, dim=2) + \
+                 - 0.5 * self.policy.m * np.log(2 * np.pi)
+            surr = torch.mean(torch.exp(LL - LL_old) * adv, dim=1)
+            # same as policy.mean_kl for every candidate
+            old_std, new_std = torch.exp(old_log_std), torch.exp(log_std)
+            Nr = (old_mean - mean) ** 2 + old_std ** 2 - new_std ** 2
+            Dr = 2 * new_std ** 2 + 1e-8
+            kl = torch.mean(torch.sum(Nr / Dr + log_std - old_log_std, dim=2), dim=1)
+        return surr.numpy(), kl.numpy()
+
+    def step_search(self, observations, actions, advantages, curr_params, direction, step_sizes,
+                    accept, first_ks=(0,), batch_size=10):
+        """
+        Finds the largest of the (decreasing) step_sizes for which accept(surr, kl) holds, where surr and kl
+        are the CPI surrogate and KL of curr_params + step_size * direction. The step sizes first_ks
+        are evaluated first, and then grids of batch_size step sizes (one batched forward pass each,
+        see batched_surrogate_kl) between the last rejected and the first accepted step sizes found.
+        The acceptance is assumed to switch only once between the points of the grid.
+        :return:    index k of the step size (None if none is accepted), its surrogate and KL,
+                    number of step sizes evaluated and number of batched forward passes
+        """
+        best = (None, None, None)
+        lo, hi = 0, len(step_sizes)
+        ks, num_evals, passes = np.unique(first_ks), 0, 0
+        while len(ks) > 0:
+            candidates = curr_params[None, :] + step_sizes[ks][:, None] * direction[None, :]
+            surr, kl = self.batched_surrogate_kl(observations, actions, advantages, candidates)
+            num_evals += len(ks)
+            passes += 1
+            accepted = accept(surr, kl)
+            if np.any(accepted):
+                j = np.argmax(accepted)
+                best = (ks[j], surr[j], kl[j])
+                lo, hi = (ks[j-1] + 1 if j > 0 else lo), ks[j]
+            else:
+                lo = ks[-1] + 1
+            # next grid over the step sizes in [lo, hi) that are left
+            ks = np.unique(np.round(np.linspace(lo, hi - 1, min(batch_size, hi - lo))).astype(int)) \
+                if hi > lo else []
+        return best + (num_evals, passes)
+
     def flat_vpg(self, observations, actions, advantages):
         cpi_surr = self.CPI_surrogate(observations, actions, advantages)
         vpg_grad = torch.autograd.grad(cpi_surr, self.policy.trainable_params)
@@ -66,6 +191,8 @@ class BatchREINFORCE:
                    gae_lambda=0.97,
                    num_cpu='max',
                    env_kwargs=None,
+                   sampler=None,
+                   env_info_keys=None,
                    ):
 
         # Clean up input arguments
@@ -76,20 +203,35 @@ class BatchREINFORCE:
 
         ts = timer.time()
 
-        if sample_mode == 'trajectories':
+        if sampler is not None:
+            # persistent workers (see mjrl/samplers/worker_pool.py) only receive the new params and transformations
+            if sample_mode == 'trajectories':
+                paths = sampler.sample_paths(N, policy=self.policy, horizon=horizon, base_seed=self.seed,
+                                             env_info_keys=env_info_keys)
+            else:
+                paths = sampler.sample_data_batch(N, policy=self.policy, horizon=horizon, base_seed=self.seed,
+                                                  env_info_keys=env_info_keys)
+        elif sample_mode == 'trajectories':
             input_dict = dict(num_traj=N, env=env, policy=self.policy, horizon=horizon,
-                              base_seed=self.seed, num_cpu=num_cpu, env_kwargs=env_kwargs)
+                              base_seed=self.seed, num_cpu=num_cpu, env_kwargs=env_kwargs,
+                              env_info_keys=env_info_keys)
             paths = trajectory_sampler.sample_paths(**input_dict)
         elif sample_mode == 'samples':
             input_dict = dict(num_samples=N, env=env, policy=self.policy, horizon=horizon,
-                              base_seed=self.seed, num_cpu=num_cpu, env_kwargs=env_kwargs)
+                              base_seed=self.seed, num_cpu=num_cpu, env_kwargs=env_kwargs,
+                              env_info_keys=env_info_keys)
             paths = trajectory_sampler.sample_data_batch(**input_dict)
 
         if self.save_logs:
             self.logger.log_kv('time_sampling', timer.time() - ts)
+            if isinstance(sampler, AsyncSampler):
+                self.logger.log_kv('policy_lag', sampler.policy_lag)
 
         self.seed = self.seed + N if self.seed is not None else self.seed
 
+        # store the paths as contiguous columns, so that they are not concatenated repeatedly below
+        paths = PathBatch(paths)
+
         # compute returns
         process_samples.compute_returns(paths, gamma)
         # compute advantages
@@ -99,7 +241,7 @@ class BatchREINFORCE:
         eval_statistics.append(N)
         # log number of samples
         if self.save_logs:
-            num_samples = np.sum([p["rewards"].shape[0] for p in paths])
+            num_samples = np.sum(path_batch.path_lengths(paths))
             self.logger.log_kv('num_samples', num_samples)
         # fit baseline
         if self.save_logs:
@@ -124,41 +266,36 @@ class BatchREINFORCE:
 
         # Optimization algorithm
         # --------------------------
-        surr_before = self.CPI_surrogate(observations, actions, advantages).data.numpy().ravel()[0]
+        self.cache_old_dist_info(observations, actions)
 
-        # VPG
+        # VPG (and surrogate before the update)
         ts = timer.time()
-        vpg_grad = self.flat_vpg(observations, actions, advantages)
+        before = self.evaluate_surrogate(observations, actions, advantages, compute_grad=True)
+        surr_before, vpg_grad = before['surr'], before['grad']
         t_gLL += timer.time() - ts
 
         # Policy update with linesearch
         # ------------------------------
         if self.desired_kl is not None:
-            max_ctr = 100
-            alpha = self.alpha
             curr_params = self.policy.get_param_values()
-            for ctr in range(max_ctr):
-                new_params = curr_params + alpha * vpg_grad
-                self.policy.set_param_values(new_params, set_new=True, set_old=False)
-                kl_dist = self.kl_old_new(observations, actions).data.numpy().ravel()[0]
-                if kl_dist <= self.desired_kl:
-                    break
-                else:
-                    print("backtracking")
-                    alpha = alpha / 2.0
+            alpha, num_evals = self.kl_step_search(observations, actions, advantages, curr_params, vpg_grad)
+            new_params = curr_params + alpha * vpg_grad
         else:
             curr_params = self.policy.get_param_values()
             new_params = curr_params + self.alpha * vpg_grad
 
         self.policy.set_param_values(new_params, set_new=True, set_old=False)
-        surr_after = self.CPI_surrogate(observations, actions, advantages).data.numpy().ravel()[0]
-        kl_dist = self.kl_old_new(observations, actions).data.numpy().ravel()[0]
+        after = self.evaluate_surrogate(observations, actions, advantages)
+        surr_after, kl_dist = after['surr'], after['kl']
+        self.clear_old_dist_info()
         self.policy.set_param_values(new_params, set_new=True, set_old=True)
 
         # Log information
         if self.save_logs:
             self.logger.log_kv('alpha', self.alpha)
             self.logger.log_kv('time_vpg', t_gLL)
+            if self.desired_kl is not None:
+                self.logger.log_kv('step_search_evals', num_evals)
             self.logger.log_kv('kl_dist', kl_dist)
             self.logger.log_kv('surr_improvement', surr_after - surr_before)
             self.logger.log_kv('running_score', self.running_score)
@@ -175,17 +312,38 @@ class BatchREINFORCE:
         return base_stats
 
 
+    def kl_step_search(self, observations, actions, advantages, curr_params, direction, max_halvings=100):
+        """
+        Largest step size alpha * 0.5^k (k < max_halvings, alpha = learn_rate) with KL <= desired_kl.
+        The first guess comes from the second order approximation KL ~ 0.5 step^2 g^T F g (F: Fisher,
+        see utils/fisher.py), and its neighbors are evaluated in the same batched forward pass.
+        :return:    step size (0 if none is accepted) and number of step sizes evaluated
+        """
+        step_sizes = self.alpha * 0.5 ** np.arange(max_halvings)
+        quad = GaussianFisher(self.policy, observations).quadratic_form(direction)
+        guess = np.sqrt(2.0 * self.desired_kl / (quad + 1e-20))
+        k0 = int(np.clip(np.ceil(np.log2(self.alpha / guess)), 0, max_halvings - 1))
+        # the full step needs no neighbors when it is expected to be accepted
+        first_ks = [0] if k0 == 0 else [k for k in (k0 - 1, k0, k0 + 1) if k < max_halvings]
+        accept = lambda surr, kl: kl <= self.desired_kl
+        k, _, _, num_evals, _ = self.step_search(observations, actions, advantages, curr_params, direction,
+                                                 step_sizes, accept, first_ks=first_ks)
+        if k is None:
+            print("Step search failed, no step size satisfies desired_kl.")
+            return 0.0, num_evals
+        return step_sizes[k], num_evals
+
     def process_paths(self, paths):
         # Concatenate from all the trajectories
-        observations = np.concatenate([path["observations"] for path in paths])
-        actions = np.concatenate([path["actions"] for path in paths])
-        advantages = np.concatenate([path["advantages"] for path in paths])
+        observations = path_batch.concat(paths, "observations")
+        actions = path_batch.concat(paths, "actions")
+        advantages = path_batch.concat(paths, "advantages")
 
         # Advantage whitening
         advantages = (advantages - np.mean(advantages)) / (np.std(advantages) + 1e-6)
 
         # cache return distributions for the paths
-        path_returns = [sum(p["rewards"]) for p in paths]
+        path_returns = path_batch.path_returns(paths)
         mean_return = np.mean(path_returns)
         std_return = np.std(path_returns)
         min_return = np.amin(path_returns)
@@ -198,7 +356,7 @@ class BatchREINFORCE:
 
 
     def log_rollout_statistics(self, paths):
-        path_returns = [sum(p["rewards"]) for p in paths]
+        path_returns = path_batch.path_returns(paths)
         mean_return = np.mean(path_returns)
         std_return = np.std(path_returns)
         min_return = np.amin(path_returns)
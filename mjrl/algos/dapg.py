@@ -15,6 +15,8 @@ import mjrl.samplers.core as trajectory_sampler
 
 # utility functions
 import mjrl.utils.process_samples as process_samples
+from mjrl.utils import path_batch
+from mjrl.utils.path_batch import PathBatch
 from mjrl.utils.logger import DataLog
 from mjrl.utils.cg_solve import cg_solve
 
@@ -28,6 +30,7 @@ class DAPG(NPG):
                  normalized_step_size=0.01,
                  FIM_invert_args={'iters': 10, 'damping': 1e-4},
                  hvp_sample_frac=1.0,
+                 hvp_stratify=False,
                  seed=123,
                  save_logs=False,
                  kl_dist=None,
@@ -44,8 +47,10 @@ class DAPG(NPG):
         self.save_logs = save_logs
         self.FIM_invert_args = FIM_invert_args
         self.hvp_subsample = hvp_sample_frac
+        self.hvp_stratify = hvp_stratify
         self.running_score = None
-        self.demo_paths = demo_paths
+        # demo paths are stored as contiguous columns once (instead of concatenating every iteration)
+        self.demo_paths = PathBatch(demo_paths) if demo_paths is not None else None
         self.lam_0 = lam_0
         self.lam_1 = lam_1
         self.iter_count = 0.0
@@ -54,14 +59,14 @@ class DAPG(NPG):
     def train_from_paths(self, paths):
 
         # Concatenate from all the trajectories
-        observations = np.concatenate([path["observations"] for path in paths])
-        actions = np.concatenate([path["actions"] for path in paths])
-        advantages = np.concatenate([path["advantages"] for path in paths])
+        observations = path_batch.concat(paths, "observations")
+        actions = path_batch.concat(paths, "actions")
+        advantages = path_batch.concat(paths, "advantages")
         advantages = (advantages - np.mean(advantages)) / (np.std(advantages) + 1e-6)
 
         if self.demo_paths is not None and self.lam_0 > 0.0:
-            demo_obs = np.concatenate([path["observations"] for path in self.demo_paths])
-            demo_act = np.concatenate([path["actions"] for path in self.demo_paths])
+            demo_obs = path_batch.concat(self.demo_paths, "observations")
+            demo_act = path_batch.concat(self.demo_paths, "actions")
             demo_adv = self.lam_0 * (self.lam_1 ** self.iter_count) * np.ones(demo_obs.shape[0])
             self.iter_count += 1
             # concatenate all
@@ -74,7 +79,7 @@ class DAPG(NPG):
             all_adv = advantages
 
         # cache return distributions for the paths
-        path_returns = [sum(p["rewards"]) for p in paths]
+        path_returns = path_batch.path_returns(paths)
         mean_return = np.mean(path_returns)
         std_return = np.std(path_returns)
         min_return = np.amin(path_returns)
@@ -90,20 +95,24 @@ class DAPG(NPG):
 
         # Optimization algorithm
         # --------------------------
-        surr_before = self.CPI_surrogate(observations, actions, advantages).data.numpy().ravel()[0]
-
-        # DAPG
+        self.cache_old_dist_info(all_obs, all_act)
+        num_samples = observations.shape[0]
+        if all_obs is not observations:
+            # the samples of the paths are the first rows of all_obs
+            LL, mean, log_std = self.old_dist_info(all_obs, all_act)
+            self.cache_old_dist_info(observations, actions, [LL[:num_samples], mean[:num_samples], log_std])
+
+        # DAPG (and surrogate before the update, from the samples of the paths)
         ts = timer.time()
         sample_coef = all_adv.shape[0]/advantages.shape[0]
-        dapg_grad = sample_coef*self.flat_vpg(all_obs, all_act, all_adv)
+        before = self.evaluate_surrogate(all_obs, all_act, all_adv, compute_grad=True)
+        surr_before = np.mean(before['LR'][:num_samples] * advantages)
+        dapg_grad = sample_coef*before['grad']
         t_gLL += timer.time() - ts
 
         # NPG
         ts = timer.time()
-        hvp = self.build_Hvp_eval([observations, actions],
-                                  regu_coef=self.FIM_invert_args['damping'])
-        npg_grad = cg_solve(hvp, dapg_grad, x_0=dapg_grad.copy(),
-                            cg_iters=self.FIM_invert_args['iters'])
+        npg_grad = self.npg_direction(observations, actions, dapg_grad, path_batch.path_lengths(paths))
         t_FIM += timer.time() - ts
 
         # Step size computation
@@ -116,8 +125,9 @@ class DAPG(NPG):
         curr_params = self.policy.get_param_values()
         new_params = curr_params + alpha * npg_grad
         self.policy.set_param_values(new_params, set_new=True, set_old=False)
-        surr_after = self.CPI_surrogate(observations, actions, advantages).data.numpy().ravel()[0]
-        kl_dist = self.kl_old_new(observations, actions).data.numpy().ravel()[0]
+        after = self.evaluate_surrogate(observations, actions, advantages)
+        surr_after, kl_dist = after['surr'], after['kl']
+        self.clear_old_dist_info()
         self.policy.set_param_values(new_params, set_new=True, set_old=True)
 
         # Log information
@@ -126,6 +136,8 @@ class DAPG(NPG):
             self.logger.log_kv('delta', n_step_size)
             self.logger.log_kv('time_vpg', t_gLL)
             self.logger.log_kv('time_npg', t_FIM)
+            for key, value in self.npg_stats.items():
+                self.logger.log_kv(key, value)
             self.logger.log_kv('kl_dist', kl_dist)
             self.logger.log_kv('surr_improvement', surr_after - surr_before)
             self.logger.log_kv('running_score', self.running_score)
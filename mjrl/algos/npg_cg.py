@@ -3,6 +3,7 @@ logging.disable(logging.CRITICAL)
 import numpy as np
 import scipy as sp
 import scipy.sparse.linalg as spLA
+import scipy.linalg as LA
 import copy
 import time as timer
 import torch
@@ -16,16 +17,22 @@ import mjrl.samplers.core as trajectory_sampler
 # utility functions
 import mjrl.utils.process_samples as process_samples
 from mjrl.utils.logger import DataLog
+from mjrl.utils import path_batch
 from mjrl.utils.cg_solve import cg_solve
+from mjrl.utils.fisher import GaussianFisher
 from mjrl.algos.batch_reinforce import BatchREINFORCE
 
 
 class NPG(BatchREINFORCE):
+    # natural gradient of the previous update (CG warm start)
+    prev_npg_grad = None
+
     def __init__(self, env, policy, baseline,
                  normalized_step_size=0.01,
                  const_learn_rate=None,
                  FIM_invert_args={'iters': 10, 'damping': 1e-4},
                  hvp_sample_frac=1.0,
+                 hvp_stratify=False,
                  seed=123,
                  save_logs=False,
                  kl_dist=None,
@@ -37,8 +44,20 @@ class NPG(BatchREINFORCE):
         :param normalized_step_size: Normalized step size (under the KL metric). Twice the desired KL distance
         :param kl_dist: desired KL distance between steps. Overrides normalized_step_size.
         :param const_learn_rate: A constant learn rate under the L2 metric (won't work very well)
-        :param FIM_invert_args: {'iters': # cg iters, 'damping': regularization amount when solving with CG
+        :param FIM_invert_args: {'iters': # cg iters, 'damping': regularization amount when solving with CG,
+                                 'fvp': 'hvp' (default, double backprop through the KL) or 'analytic'
+                                 (closed form Fisher of Gaussian policies, see utils/fisher.py),
+                                 'solver': 'cg' (default), 'cholesky' (explicit Fisher matrix and direct solve,
+                                 for small policies) or 'auto' (cholesky for linear policies with at most
+                                 'max_cholesky_params' params (default 2000), cg otherwise). The exact solve of
+                                 an MLP Fisher with the damping tuned for CG gives far too large steps (CG
+                                 with few iters regularizes the small eigenvalues), so MLPs need a larger
+                                 damping with 'cholesky' and are never sent to it by 'auto',
+                                 and for cg: 'warm_start': start from the previous natural gradient (default False),
+                                 'preconditioner': None (default) or 'jacobi' (diagonal of the Fisher),
+                                 'residual_tol': stop when the relative residual is below this (default None)}
         :param hvp_sample_frac: fraction of samples (>0 and <=1) to use for the Fisher metric (start with 1 and reduce if code too slow)
+        :param hvp_stratify: subsample the same fraction of every path (instead of the whole batch)
         :param seed: random seed
         """
 
@@ -51,6 +70,7 @@ class NPG(BatchREINFORCE):
         self.save_logs = save_logs
         self.FIM_invert_args = FIM_invert_args
         self.hvp_subsample = hvp_sample_frac
+        self.hvp_stratify = hvp_stratify
         self.running_score = None
         if save_logs: self.logger = DataLog()
         # input normalization (running average)
@@ -59,19 +79,13 @@ class NPG(BatchREINFORCE):
             if self.input_normalization > 1 or self.input_normalization <= 0:
                 self.input_normalization = None
 
-    def HVP(self, observations, actions, vector, regu_coef=None):
+    def HVP(self, observations, actions, vector, regu_coef=None, old_dist_info=None):
+        # Fisher (Hessian of the KL) vector product on the given samples (see build_Hvp_eval for subsampling)
         regu_coef = self.FIM_invert_args['damping'] if regu_coef is None else regu_coef
         vec = Variable(torch.from_numpy(vector).float(), requires_grad=False)
-        if self.hvp_subsample is not None and self.hvp_subsample < 0.99:
-            num_samples = observations.shape[0]
-            rand_idx = np.random.choice(num_samples, size=int(self.hvp_subsample*num_samples))
-            obs = observations[rand_idx]
-            act = actions[rand_idx]
-        else:
-            obs = observations
-            act = actions
-        old_dist_info = self.policy.old_dist_info(obs, act)
-        new_dist_info = self.policy.new_dist_info(obs, act)
+        if old_dist_info is None:
+            old_dist_info = self.old_dist_info(observations, actions)
+        new_dist_info = self.policy.new_dist_info(observations, actions)
         mean_kl = self.policy.mean_kl(new_dist_info, old_dist_info)
         grad_fo = torch.autograd.grad(mean_kl, self.policy.trainable_params, create_graph=True)
         flat_grad = torch.cat([g.contiguous().view(-1) for g in grad_fo])
@@ -80,13 +94,91 @@ class NPG(BatchREINFORCE):
         hvp_flat = np.concatenate([g.contiguous().view(-1).data.numpy() for g in hvp])
         return hvp_flat + regu_coef*vector
 
-    def build_Hvp_eval(self, inputs, regu_coef=None):
+    def FVP(self, fisher, vector, regu_coef=None):
+        # same as HVP, but with the closed form Fisher (see utils/fisher.py)
+        regu_coef = self.FIM_invert_args['damping'] if regu_coef is None else regu_coef
+        return fisher.fvp(vector) + regu_coef*vector
+
+    def hvp_sample_idx(self, num_samples, path_lengths=None):
+        """
+        Samples used for the Fisher (hvp_sample_frac of them), drawn once per update so that all the
+        products use the same matrix. Without replacement, and per path if hvp_stratify (needs path_lengths).
+        :return:    indices of the samples (None to use all of them)
+        """
+        if self.hvp_subsample is None or self.hvp_subsample >= 0.99:
+            return None
+        if self.hvp_stratify and path_lengths is not None:
+            return path_batch.stratified_sample_idx(path_lengths, self.hvp_subsample)
+        return np.sort(np.random.choice(num_samples, size=int(self.hvp_subsample*num_samples), replace=False))
+
+    def build_Hvp_eval(self, inputs, regu_coef=None, sample_idx=None, resample=True):
+        """
+        :param inputs:      [observations, actions]
+        :param sample_idx:  indices of the samples for the Fisher. If None, a subsample is drawn with
+                            hvp_sample_idx when resample is True, and all the samples are used otherwise
+        :param resample:    draw a new subsample when sample_idx is None
+        """
+        observations, actions = inputs
+        if sample_idx is None and resample:
+            sample_idx = self.hvp_sample_idx(observations.shape[0])
+        old_dist_info = self.old_dist_info(observations, actions, sample_idx)
+        if sample_idx is not None:
+            observations, actions = observations[sample_idx], actions[sample_idx]
+        # indexed and converted once, and reused by all the products
+        obs_var = torch.from_numpy(np.float32(observations))
+        act_var = torch.from_numpy(np.float32(actions))
+        if self.FIM_invert_args.get('fvp', 'hvp') == 'analytic':
+            fisher = GaussianFisher(self.policy, obs_var)
+            return lambda v: self.FVP(fisher, v, regu_coef)
         def eval(v):
-            full_inp = inputs + [v] + [regu_coef]
-            Hvp = self.HVP(*full_inp)
-            return Hvp
+            return self.HVP(obs_var, act_var, v, regu_coef, old_dist_info)
         return eval
 
+    def npg_direction(self, observations, actions, grad, path_lengths=None):
+        """
+        Solves (F + damping*I) x = grad, where F is the Fisher, with CG or with a Cholesky
+        factorization of the explicit Fisher matrix (see FIM_invert_args).
+        :param path_lengths:    lengths of the paths the samples come from (for hvp_stratify)
+        Stats of the solve are left in self.npg_stats (for logging).
+        """
+        solver = self.FIM_invert_args.get('solver', 'cg')
+        sample_idx = self.hvp_sample_idx(observations.shape[0], path_lengths)
+        # same keys with every solver, so that the logged columns stay aligned
+        self.npg_stats = dict(hvp_samples=observations.shape[0] if sample_idx is None else len(sample_idx),
+                              time_fisher=0.0, cg_iters=0, npg_residual=0.0)
+        if solver == 'auto':
+            # the matrix of a linear policy is cheap to build (see utils/fisher.py), and the KL is
+            # quadratic in its mean params, so the exact natural step stays close to the KL target
+            is_linear = len(self.policy.model.fc_layers) == 1
+            small = self.policy.d <= self.FIM_invert_args.get('max_cholesky_params', 2000)
+            solver = 'cholesky' if is_linear and small else 'cg'
+        if solver == 'cholesky':
+            ts = timer.time()
+            fisher = GaussianFisher(self.policy, observations)
+            F = fisher.matrix(sample_idx) + self.FIM_invert_args['damping'] * np.eye(self.policy.d)
+            try:
+                npg_grad = LA.cho_solve(LA.cho_factor(F), grad)
+                self.npg_stats['time_fisher'] = timer.time() - ts
+                self.npg_stats['npg_residual'] = np.linalg.norm(F.dot(npg_grad) - grad) / (np.linalg.norm(grad) + 1e-20)
+                return npg_grad
+            except LA.LinAlgError:
+                print("Cholesky factorization of the Fisher failed. Using CG instead.")
+                self.npg_stats['time_fisher'] = timer.time() - ts
+        hvp = self.build_Hvp_eval([observations, actions],
+                                  regu_coef=self.FIM_invert_args['damping'], sample_idx=sample_idx, resample=False)
+        x_0 = self.prev_npg_grad if self.FIM_invert_args.get('warm_start', False) else None
+        M_inv = None
+        if self.FIM_invert_args.get('preconditioner', None) == 'jacobi':
+            fisher_diag = GaussianFisher(self.policy, observations).diagonal(sample_idx)
+            M_inv = 1.0 / (fisher_diag + self.FIM_invert_args['damping'])
+        cg_stats = dict()
+        npg_grad = cg_solve(hvp, grad, x_0=x_0, cg_iters=self.FIM_invert_args['iters'], M_inv=M_inv,
+                            rel_tol=self.FIM_invert_args.get('residual_tol', None), stats=cg_stats)
+        self.prev_npg_grad = npg_grad
+        self.npg_stats['cg_iters'] = cg_stats['iters']
+        self.npg_stats['npg_residual'] = cg_stats['residual']
+        return npg_grad
+
     # ----------------------------------------------------------
     def train_from_paths(self, paths):
 
@@ -108,19 +200,17 @@ class NPG(BatchREINFORCE):
 
         # Optimization algorithm
         # --------------------------
-        surr_before = self.CPI_surrogate(observations, actions, advantages).data.numpy().ravel()[0]
+        self.cache_old_dist_info(observations, actions)
 
-        # VPG
+        # VPG (and surrogate before the update)
         ts = timer.time()
-        vpg_grad = self.flat_vpg(observations, actions, advantages)
+        before = self.evaluate_surrogate(observations, actions, advantages, compute_grad=True)
+        surr_before, vpg_grad = before['surr'], before['grad']
         t_gLL += timer.time() - ts
 
         # NPG
         ts = timer.time()
-        hvp = self.build_Hvp_eval([observations, actions],
-                                  regu_coef=self.FIM_invert_args['damping'])
-        npg_grad = cg_solve(hvp, vpg_grad, x_0=vpg_grad.copy(),
-                            cg_iters=self.FIM_invert_args['iters'])
+        npg_grad = self.npg_direction(observations, actions, vpg_grad, path_batch.path_lengths(paths))
         t_FIM += timer.time() - ts
 
         # Step size computation
@@ -137,8 +227,9 @@ class NPG(BatchREINFORCE):
         curr_params = self.policy.get_param_values()
         new_params = curr_params + alpha * npg_grad
         self.policy.set_param_values(new_params, set_new=True, set_old=False)
-        surr_after = self.CPI_surrogate(observations, actions, advantages).data.numpy().ravel()[0]
-        kl_dist = self.kl_old_new(observations, actions).data.numpy().ravel()[0]
+        after = self.evaluate_surrogate(observations, actions, advantages)
+        surr_after, kl_dist = after['surr'], after['kl']
+        self.clear_old_dist_info()
         self.policy.set_param_values(new_params, set_new=True, set_old=True)
 
         # Log information
@@ -147,6 +238,8 @@ class NPG(BatchREINFORCE):
             self.logger.log_kv('delta', n_step_size)
             self.logger.log_kv('time_vpg', t_gLL)
             self.logger.log_kv('time_npg', t_FIM)
+            for key, value in self.npg_stats.items():
+                self.logger.log_kv(key, value)
             self.logger.log_kv('kl_dist', kl_dist)
             self.logger.log_kv('surr_improvement', surr_after - surr_before)
             self.logger.log_kv('running_score', self.running_score)
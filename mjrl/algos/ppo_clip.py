@@ -15,6 +15,7 @@ import mjrl.samplers.core as trajectory_sampler
 
 # utility functions
 import mjrl.utils.process_samples as process_samples
+from mjrl.utils import path_batch
 from mjrl.utils.logger import DataLog
 from mjrl.utils.cg_solve import cg_solve
 from mjrl.algos.batch_reinforce import BatchREINFORCE
@@ -28,8 +29,16 @@ class PPO(BatchREINFORCE):
                  learn_rate = 3e-4,
                  seed = 123,
                  save_logs = False,
+                 target_kl = None,
                  **kwargs
                  ):
+        """
+        :param clip_coef:   clipping of the likelihood ratio in the PPO surrogate
+        :param epochs:      number of passes over the batch per update
+        :param mb_size:     minibatch size (the last minibatch of an epoch holds the remaining samples)
+        :param learn_rate:  learn rate of Adam
+        :param target_kl:   stop the epochs early once the KL to the old policy is above this (None to run all epochs)
+        """
 
         self.env = env
         self.policy = policy
@@ -40,16 +49,23 @@ class PPO(BatchREINFORCE):
         self.clip_coef = clip_coef
         self.epochs = epochs
         self.mb_size = mb_size
+        self.target_kl = target_kl
         self.running_score = None
         if save_logs: self.logger = DataLog()
 
         self.optimizer = torch.optim.Adam(self.policy.trainable_params, lr=learn_rate)
 
-    def PPO_surrogate(self, observations, actions, advantages):
-        adv_var = Variable(torch.from_numpy(advantages).float(), requires_grad=False)
-        old_dist_info = self.policy.old_dist_info(observations, actions)
+    def PPO_surrogate(self, observations, actions, advantages, old_LL=None):
+        # observations, actions and advantages can be numpy arrays or float tensors
+        # old_LL: log likelihoods of the actions under the old policy (computed if None)
+        if type(advantages) is not torch.Tensor:
+            adv_var = Variable(torch.from_numpy(advantages).float(), requires_grad=False)
+        else:
+            adv_var = advantages
+        if old_LL is None:
+            old_LL = self.policy.old_dist_info(observations, actions)[0]
         new_dist_info = self.policy.new_dist_info(observations, actions)
-        LR = self.policy.likelihood_ratio(new_dist_info, old_dist_info)
+        LR = torch.exp(new_dist_info[0] - old_LL)
         LR_clip = torch.clamp(LR, min=1-self.clip_coef, max=1+self.clip_coef)
         ppo_surr = torch.mean(torch.min(LR*adv_var,LR_clip*adv_var))
         return ppo_surr
@@ -58,9 +74,9 @@ class PPO(BatchREINFORCE):
     def train_from_paths(self, paths):
 
         # Concatenate from all the trajectories
-        observations = np.concatenate([path["observations"] for path in paths])
-        actions = np.concatenate([path["actions"] for path in paths])
-        advantages = np.concatenate([path["advantages"] for path in paths])
+        observations = path_batch.concat(paths, "observations")
+        actions = path_batch.concat(paths, "actions")
+        advantages = path_batch.concat(paths, "advantages")
         # Advantage whitening
         advantages = (advantages - np.mean(advantages)) / (np.std(advantages) + 1e-6)
         # NOTE : advantage should be zero mean in expectation
@@ -68,7 +84,7 @@ class PPO(BatchREINFORCE):
         # but scaling can help with least squares
 
         # cache return distributions for the paths
-        path_returns = [sum(p["rewards"]) for p in paths]
+        path_returns = path_batch.path_returns(paths)
         mean_return = np.mean(path_returns)
         std_return = np.std(path_returns)
         min_return = np.amin(path_returns)
@@ -80,25 +96,37 @@ class PPO(BatchREINFORCE):
 
         # Optimization algorithm
         # --------------------------
-        surr_before = self.CPI_surrogate(observations, actions, advantages).data.numpy().ravel()[0]
-        params_before_opt = self.policy.get_param_values()
+        self.cache_old_dist_info(observations, actions)
+        surr_before = self.evaluate_surrogate(observations, actions, advantages)['surr']
 
         ts = timer.time()
+        # the batch is converted once, and the old log likelihoods come from the cache
+        obs_var = torch.from_numpy(np.float32(observations))
+        act_var = torch.from_numpy(np.float32(actions))
+        adv_var = torch.from_numpy(np.float32(advantages))
+        old_LL = self.old_dist_info(observations, actions)[0]
         num_samples = observations.shape[0]
+        num_epochs = 0
         for ep in range(self.epochs):
-            for mb in range(int(num_samples / self.mb_size)):
-                rand_idx = np.random.choice(num_samples, size=self.mb_size)
-                obs = observations[rand_idx]
-                act = actions[rand_idx]
-                adv = advantages[rand_idx]
+            # every sample is used once per epoch (including the tail of the permutation)
+            perm = torch.from_numpy(np.random.permutation(num_samples))
+            for start in range(0, num_samples, self.mb_size):
+                mb_idx = perm[start:start+self.mb_size]
                 self.optimizer.zero_grad()
-                loss = - self.PPO_surrogate(obs, act, adv)
+                loss = - self.PPO_surrogate(obs_var[mb_idx], act_var[mb_idx], adv_var[mb_idx], old_LL[mb_idx])
                 loss.backward()
                 self.optimizer.step()
+            num_epochs += 1
+            if self.target_kl is not None and ep < self.epochs - 1:
+                with torch.no_grad():
+                    kl_dist = self.kl_old_new(observations, actions).item()
+                if kl_dist > self.target_kl:
+                    break
 
         params_after_opt = self.policy.get_param_values()
-        surr_after = self.CPI_surrogate(observations, actions, advantages).data.numpy().ravel()[0]
-        kl_dist = self.kl_old_new(observations, actions).data.numpy().ravel()[0]
+        after = self.evaluate_surrogate(observations, actions, advantages)
+        surr_after, kl_dist = after['surr'], after['kl']
+        self.clear_old_dist_info()
         self.policy.set_param_values(params_after_opt, set_new=True, set_old=True)
         t_opt = timer.time() - ts
 
@@ -106,6 +134,7 @@ class PPO(BatchREINFORCE):
         if self.save_logs:
             self.logger.log_kv('t_opt', t_opt)
             self.logger.log_kv('kl_dist', kl_dist)
+            self.logger.log_kv('ppo_epochs', num_epochs)
             self.logger.log_kv('surr_improvement', surr_after - surr_before)
             self.logger.log_kv('running_score', self.running_score)
             try:
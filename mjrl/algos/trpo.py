@@ -12,10 +12,10 @@ import copy
 
 # samplers
 import mjrl.samplers.core as trajectory_sampler
-import mjrl.samplers.batch_sampler as batch_sampler
 
 # utility functions
 import mjrl.utils.process_samples as process_samples
+from mjrl.utils import path_batch
 from mjrl.utils.logger import DataLog
 from mjrl.utils.cg_solve import cg_solve
 
@@ -27,9 +27,11 @@ class TRPO(NPG):
                  kl_dist=0.01,
                  FIM_invert_args={'iters': 10, 'damping': 1e-4},
                  hvp_sample_frac=1.0,
+                 hvp_stratify=False,
                  seed=123,
                  save_logs=False,
                  normalized_step_size=0.01,
+                 line_search_batch=10,
                  **kwargs
                  ):
         """
@@ -37,8 +39,11 @@ class TRPO(NPG):
         :param normalized_step_size: Normalized step size (under the KL metric). Twice the desired KL distance
         :param kl_dist: desired KL distance between steps. Overrides normalized_step_size.
         :param const_learn_rate: A constant learn rate under the L2 metric (won't work very well)
-        :param FIM_invert_args: {'iters': # cg iters, 'damping': regularization amount when solving with CG
+        :param FIM_invert_args: {'iters': # cg iters, 'damping': regularization amount when solving with CG,
+                                 'fvp': 'hvp' or 'analytic', 'solver': 'cg', 'cholesky' or 'auto' (see NPG)}
         :param hvp_sample_frac: fraction of samples (>0 and <=1) to use for the Fisher metric (start with 1 and reduce if code too slow)
+        :param hvp_stratify: subsample the same fraction of every path (instead of the whole batch)
+        :param line_search_batch: number of step sizes of the backtracking line search evaluated with one batched forward pass
         :param seed: random seed
         """
 
@@ -49,16 +54,18 @@ class TRPO(NPG):
         self.seed = seed
         self.save_logs = save_logs
         self.FIM_invert_args = FIM_invert_args
+        self.line_search_batch = line_search_batch
         self.hvp_subsample = hvp_sample_frac
+        self.hvp_stratify = hvp_stratify
         self.running_score = None
         if save_logs: self.logger = DataLog()
 
     def train_from_paths(self, paths):
 
         # Concatenate from all the trajectories
-        observations = np.concatenate([path["observations"] for path in paths])
-        actions = np.concatenate([path["actions"] for path in paths])
-        advantages = np.concatenate([path["advantages"] for path in paths])
+        observations = path_batch.concat(paths, "observations")
+        actions = path_batch.concat(paths, "actions")
+        advantages = path_batch.concat(paths, "advantages")
         # Advantage whitening
         advantages = (advantages - np.mean(advantages)) / (np.std(advantages) + 1e-6)
         # NOTE : advantage should be zero mean in expectation
@@ -66,7 +73,7 @@ class TRPO(NPG):
         # but scaling can help with least squares
 
         # cache return distributions for the paths
-        path_returns = [sum(p["rewards"]) for p in paths]
+        path_returns = path_batch.path_returns(paths)
         mean_return = np.mean(path_returns)
         std_return = np.std(path_returns)
         min_return = np.amin(path_returns)
@@ -82,19 +89,17 @@ class TRPO(NPG):
 
         # Optimization algorithm
         # --------------------------
-        surr_before = self.CPI_surrogate(observations, actions, advantages).data.numpy().ravel()[0]
+        self.cache_old_dist_info(observations, actions)
 
-        # VPG
+        # VPG (and surrogate before the update)
         ts = timer.time()
-        vpg_grad = self.flat_vpg(observations, actions, advantages)
+        before = self.evaluate_surrogate(observations, actions, advantages, compute_grad=True)
+        surr_before, vpg_grad = before['surr'], before['grad']
         t_gLL += timer.time() - ts
 
         # NPG
         ts = timer.time()
-        hvp = self.build_Hvp_eval([observations, actions],
-                                  regu_coef=self.FIM_invert_args['damping'])
-        npg_grad = cg_solve(hvp, vpg_grad, x_0=vpg_grad.copy(),
-                            cg_iters=self.FIM_invert_args['iters'])
+        npg_grad = self.npg_direction(observations, actions, vpg_grad, path_batch.path_lengths(paths))
         t_FIM += timer.time() - ts
 
         # Step size computation
@@ -102,35 +107,29 @@ class TRPO(NPG):
         n_step_size = 2.0*self.kl_dist
         alpha = np.sqrt(np.abs(n_step_size / (np.dot(vpg_grad.T, npg_grad) + 1e-20)))
 
-        # Policy update
+        # Policy update (backtracking line search)
         # --------------------------
         curr_params = self.policy.get_param_values()
-        for k in range(100):
-            new_params = curr_params + alpha * npg_grad
-            self.policy.set_param_values(new_params, set_new=True, set_old=False)
-            kl_dist = self.kl_old_new(observations, actions).data.numpy().ravel()[0]
-            surr_after = self.CPI_surrogate(observations, actions, advantages).data.numpy().ravel()[0]
-            if kl_dist < self.kl_dist:
-                break
-            else:
-                alpha = 0.9*alpha # backtrack
-                print("Step size too high. Backtracking. | kl = %f | surr diff = %f" % \
-                      (kl_dist, surr_after-surr_before) )
-            if k == 99:
-                alpha = 0.0
+        alpha, kl_dist, surr_after, backtracks, passes = self.line_search(observations, actions, advantages,
+                                                                          curr_params, npg_grad, alpha, surr_before)
+        if backtracks > 0:
+            print("Step size too high. Backtracked %i times. | kl = %f | surr diff = %f" % \
+                  (backtracks, kl_dist, surr_after - surr_before))
 
         new_params = curr_params + alpha * npg_grad
-        self.policy.set_param_values(new_params, set_new=True, set_old=False)
-        kl_dist = self.kl_old_new(observations, actions).data.numpy().ravel()[0]
-        surr_after = self.CPI_surrogate(observations, actions, advantages).data.numpy().ravel()[0]
+        self.clear_old_dist_info()
         self.policy.set_param_values(new_params, set_new=True, set_old=True)
 
         # Log information
         if self.save_logs:
             self.logger.log_kv('alpha', alpha)
             self.logger.log_kv('delta', n_step_size)
+            self.logger.log_kv('line_search_backtracks', backtracks)
+            self.logger.log_kv('line_search_passes', passes)
             self.logger.log_kv('time_vpg', t_gLL)
             self.logger.log_kv('time_npg', t_FIM)
+            for key, value in self.npg_stats.items():
+                self.logger.log_kv(key, value)
             self.logger.log_kv('kl_dist', kl_dist)
             self.logger.log_kv('surr_improvement', surr_after - surr_before)
             self.logger.log_kv('running_score', self.running_score)
@@ -144,4 +143,22 @@ class TRPO(NPG):
                 except:
                     pass
 
-        return base_stats
\ No newline at end of file
+        return base_stats
+
+    def line_search(self, observations, actions, advantages, curr_params, direction, alpha, surr_before,
+                    backtrack_ratio=0.9, max_backtracks=100):
+        """
+        Finds the largest step size alpha * backtrack_ratio^k (k < max_backtracks) such that the KL
+        to the old policy is below kl_dist and the surrogate improves. The full step is tried first,
+        and then batches of line_search_batch backtracks (see step_search).
+        :return:    step size (0 if none is accepted), its KL and surrogate, number of backtracks
+                    and number of batched forward passes used
+        """
+        step_sizes = alpha * backtrack_ratio ** np.arange(max_backtracks)
+        accept = lambda surr, kl: (kl < self.kl_dist) & (surr > surr_before)
+        k, surr, kl, _, passes = self.step_search(observations, actions, advantages, curr_params, direction,
+                                                  step_sizes, accept, first_ks=[0], batch_size=self.line_search_batch)
+        if k is None:
+            print("Line search failed, no step size was accepted.")
+            return 0.0, 0.0, surr_before, max_backtracks, passes
+        return step_sizes[k], kl, surr, k, passes
@@ -1,5 +1,6 @@
 import numpy as np
 import copy
+from mjrl.utils import path_batch
 
 
 class LinearBaseline:
@@ -12,7 +13,7 @@ class LinearBaseline:
         if self.inp == 'env_features':
             o = np.concatenate([path["env_infos"]["env_features"][0] for path in paths])
         else:
-            o = np.concatenate([path["observations"] for path in paths])
+            o = path_batch.concat(paths, "observations")
         o = np.clip(o, -10, 10)/10.0
         if o.ndim > 2:
             o = o.reshape(o.shape[0], -1)
@@ -23,20 +24,17 @@ class LinearBaseline:
         # linear features
         feat_mat[:,:n] = o
 
-        k = 0  # start from this row
-        for i in range(len(paths)):
-            l = len(paths[i]["rewards"])
-            al = np.arange(l)/1000.0
-            for j in range(4):
-                feat_mat[k:k+l, -4+j] = al**(j+1)
-            k += l
+        # time features
+        al = path_batch.time_steps(paths)/1000.0
+        for j in range(4):
+            feat_mat[:, -4+j] = al**(j+1)
 
         return feat_mat
 
     def fit(self, paths, return_errors=False):
 
         featmat = self._features(paths)
-        returns = np.concatenate([path["returns"] for path in paths])
+        returns = path_batch.concat(paths, "returns")
 
         if return_errors:
             predictions = featmat.dot(self._coeffs) if self._coeffs is not None else np.zeros(returns.shape)
@@ -4,6 +4,7 @@ import torch
 import torch.nn as nn
 from torch.autograd import Variable
 from mjrl.utils.optimize_model import fit_data
+from mjrl.utils import path_batch
 
 import pickle
 
@@ -37,7 +38,7 @@ class MLPBaseline:
         if self.inp == 'env_features':
             o = np.concatenate([path["env_infos"]["env_features"][0] for path in paths])
         else:
-            o = np.concatenate([path["observations"] for path in paths])
+            o = path_batch.concat(paths, "observations")
         o = np.clip(o, -10, 10)/10.0
         if o.ndim > 2:
             o = o.reshape(o.shape[0], -1)
@@ -48,20 +49,17 @@ class MLPBaseline:
         # linear features
         feat_mat[:,:n] = o
 
-        k = 0  # start from this row
-        for i in range(len(paths)):
-            l = len(paths[i]["rewards"])
-            al = np.arange(l)/1000.0
-            for j in range(4):
-                feat_mat[k:k+l, -4+j] = al**(j+1)
-            k += l
+        # time features
+        al = path_batch.time_steps(paths)/1000.0
+        for j in range(4):
+            feat_mat[:, -4+j] = al**(j+1)
         return feat_mat
 
 
     def fit(self, paths, return_errors=False):
 
         featmat = self._features(paths)
-        returns = np.concatenate([path["returns"] for path in paths]).reshape(-1, 1)
+        returns = path_batch.concat(paths, "returns").reshape(-1, 1)
         featmat = featmat.astype('float32')
         returns = returns.astype('float32')
         num_samples = returns.shape[0]
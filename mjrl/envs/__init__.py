@@ -1,4 +1,5 @@
 from gym.envs.registration import register
+from gym.error import DependencyNotInstalled
 
 # ----------------------------------------
 # mjrl environments
@@ -6,32 +7,36 @@ from gym.envs.registration import register
 
 register(
     id='mjrl_point_mass-v0',
-    entry_point='mjrl.envs:PointMassEnv',
+    entry_point='mjrl.envs.point_mass:PointMassEnv',
     max_episode_steps=25,
 )
 
 register(
     id='mjrl_swimmer-v0',
-    entry_point='mjrl.envs:SwimmerEnv',
+    entry_point='mjrl.envs.swimmer:SwimmerEnv',
     max_episode_steps=500,
 )
 
 register(
     id='mjrl_reacher_7dof-v0',
-    entry_point='mjrl.envs:Reacher7DOFEnv',
+    entry_point='mjrl.envs.reacher_sawyer:Reacher7DOFEnv',
     max_episode_steps=50,
 )
 
 register(
     id='mjrl_peg_insertion-v0',
-    entry_point='mjrl.envs:PegEnv',
+    entry_point='mjrl.envs.peg_insertion_sawyer:PegEnv',
     max_episode_steps=50,
 )
 
-from mjrl.envs.mujoco_env import MujocoEnv
-# ^^^^^ so that user gets the correct error
-# message if mujoco is not installed correctly
-from mjrl.envs.point_mass import PointMassEnv
-from mjrl.envs.swimmer import SwimmerEnv
-from mjrl.envs.reacher_sawyer import Reacher7DOFEnv
-from mjrl.envs.peg_insertion_sawyer import PegEnv
+try:
+    from mjrl.envs.mujoco_env import MujocoEnv
+    from mjrl.envs.point_mass import PointMassEnv
+    from mjrl.envs.swimmer import SwimmerEnv
+    from mjrl.envs.reacher_sawyer import Reacher7DOFEnv
+    from mjrl.envs.peg_insertion_sawyer import PegEnv
+except DependencyNotInstalled:
+    # the rest of mjrl is usable without mujoco (e.g. with other gym envs).
+    # the entry points above point to the env modules, so that the user
+    # gets the correct error message when making an env without mujoco
+    pass
@@ -3,7 +3,8 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torch.autograd import Variable
-from mjrl.utils.fc_network import FCNetwork
+import threading
+from mjrl.utils.fc_network import FCNetwork, inference_mode
 
 
 class LinearPolicy:
@@ -51,56 +52,106 @@ class LinearPolicy:
         self.param_sizes = [p.data.numpy().size for p in self.trainable_params]
         self.d = np.sum(self.param_sizes)  # total number of params
 
+        # Flat parameter storage: params are views into one contiguous buffer
+        # (separately for the new and old policy), so that get/set are single copies
+        # ------------------------
+        self.flat_params = self._flatten_params(self.trainable_params)
+        self.old_flat_params = self._flatten_params(self.old_params)
+
         # Placeholders
         # ------------------------
         self.obs_var = Variable(torch.randn(self.n), requires_grad=False)
 
     # Utility functions
     # ============================================
+    def _flatten_params(self, params):
+        flat = torch.cat([p.data.contiguous().view(-1) for p in params])
+        current_idx = 0
+        for idx, param in enumerate(params):
+            param.data = flat[current_idx:current_idx + self.param_sizes[idx]].view(self.param_shapes[idx])
+            current_idx += self.param_sizes[idx]
+        return flat
+
+    def __setstate__(self, state):
+        # copies (pickle, deepcopy) get separate tensors for the params, so the views into
+        # the flat buffers are rebuilt (this also covers policies pickled without them)
+        self.__dict__.update(state)
+        self.flat_params = self._flatten_params(self.trainable_params)
+        self.old_flat_params = self._flatten_params(self.old_params)
+
     def get_param_values(self):
-        params = np.concatenate([p.contiguous().view(-1).data.numpy()
-                                 for p in self.trainable_params])
-        return params.copy()
+        return self.flat_params.numpy().copy()
 
     def set_param_values(self, new_params, set_new=True, set_old=True):
         if set_new:
-            current_idx = 0
-            for idx, param in enumerate(self.trainable_params):
-                vals = new_params[current_idx:current_idx + self.param_sizes[idx]]
-                vals = vals.reshape(self.param_shapes[idx])
-                param.data = torch.from_numpy(vals).float()
-                current_idx += self.param_sizes[idx]
+            self.flat_params.copy_(torch.from_numpy(np.asarray(new_params, dtype=np.float32)))
             # clip std at minimum value
-            self.trainable_params[-1].data = \
-                torch.clamp(self.trainable_params[-1], self.min_log_std).data
+            self.log_std.data.clamp_(min=self.min_log_std)
             # update log_std_val for sampling
             self.log_std_val = np.float64(self.log_std.data.numpy().ravel())
         if set_old:
-            current_idx = 0
-            for idx, param in enumerate(self.old_params):
-                vals = new_params[current_idx:current_idx + self.param_sizes[idx]]
-                vals = vals.reshape(self.param_shapes[idx])
-                param.data = torch.from_numpy(vals).float()
-                current_idx += self.param_sizes[idx]
-            # clip std at minimum value
-            self.old_params[-1].data = \
-                torch.clamp(self.old_params[-1], self.min_log_std).data
+            if set_new:
+                self.old_flat_params.copy_(self.flat_params)
+            else:
+                self.old_flat_params.copy_(torch.from_numpy(np.asarray(new_params, dtype=np.float32)))
+                # clip std at minimum value
+                self.old_log_std.data.clamp_(min=self.min_log_std)
 
     # Main functions
     # ============================================
-    def get_action(self, observation):
+    def get_action(self, observation, rng=None):
+        # rng: np.random.Generator for the action noise (global np.random if None)
         o = np.float32(observation.reshape(1, -1))
-        self.obs_var.data = torch.from_numpy(o)
-        mean = self.model(self.obs_var).data.numpy().ravel()
-        noise = np.exp(self.log_std_val) * np.random.randn(self.m)
+        # local input tensor, so that several threads can query the policy
+        with inference_mode():
+            mean = self.model(torch.from_numpy(o)).numpy().ravel()
+        rng = np.random if rng is None else rng
+        noise = np.exp(self.log_std_val) * rng.standard_normal(self.m)
         action = mean + noise
         return [action, {'mean': mean, 'log_std': self.log_std_val, 'evaluation': mean}]
 
+    def get_actions(self, observations, rngs=None):
+        """
+        Batched inference (e.g. once per step for several envs), without building an autograd graph.
+        The input and noise buffers are allocated once per batch size (and thread) and reused.
+        :param observations:    array of shape (N, n)
+        :param rngs:            list of N np.random.Generator, one per row (global np.random if None)
+        :return:                actions (N, m) and the batched agent_infos (log_std is a read-only view)
+        """
+        o, noise = self._inference_buffers(observations.shape[0])
+        np.copyto(o, observations.reshape(o.shape), casting='unsafe')
+        with inference_mode():
+            mean = self.model(torch.from_numpy(o)).numpy()
+        if rngs is None:
+            noise = np.random.standard_normal(mean.shape)
+        else:
+            for i, rng in enumerate(rngs):
+                rng.standard_normal(out=noise[i])
+        action = mean + np.exp(self.log_std_val) * noise
+        log_std = np.broadcast_to(self.log_std_val, mean.shape)
+        return [action, {'mean': mean, 'log_std': log_std, 'evaluation': mean}]
+
+    def _inference_buffers(self, N):
+        # buffers are per thread (several threads can query the policy) and are plain numpy
+        # arrays, so that copies of the policy (pickle, deepcopy) get their own buffers
+        if '_buffers' not in self.__dict__:
+            self._buffers = dict()
+        key = (threading.get_ident(), N)
+        if key not in self._buffers:
+            self._buffers[key] = (np.zeros((N, self.n), dtype=np.float32), np.zeros((N, self.m)))
+        return self._buffers[key]
+
     def mean_LL(self, observations, actions, model=None, log_std=None):
         model = self.model if model is None else model
         log_std = self.log_std if log_std is None else log_std
-        obs_var = Variable(torch.from_numpy(observations).float(), requires_grad=False)
-        act_var = Variable(torch.from_numpy(actions).float(), requires_grad=False)
+        if type(observations) is not torch.Tensor:
+            obs_var = Variable(torch.from_numpy(observations).float(), requires_grad=False)
+        else:
+            obs_var = observations
+        if type(actions) is not torch.Tensor:
+            act_var = Variable(torch.from_numpy(actions).float(), requires_grad=False)
+        else:
+            act_var = actions
         mean = model(obs_var)
         zs = (act_var - mean) / torch.exp(log_std)
         LL = - 0.5 * torch.sum(zs ** 2, dim=1) + \
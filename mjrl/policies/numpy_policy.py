@@ -0,0 +1,119 @@
+"""
+Torch-free copy of a Gaussian policy (MLP or LinearPolicy) for rollout workers.
+Weights are kept as contiguous float32 numpy arrays and the forward pass is a few
+BLAS matmuls, which is faster than torch for the small networks used here and does
+not need torch in the worker.
+"""
+
+import numpy as np
+
+
+def get_transformations(policy):
+    # (in_shift, in_scale, out_shift, out_scale) of the model of a torch policy (MLP or LinearPolicy)
+    model = policy.model
+    return [t.data.numpy() for t in (model.in_shift, model.in_scale, model.out_shift, model.out_scale)]
+
+
+class NumpyPolicy:
+    def __init__(self, weights, biases,
+                 in_shift, in_scale,
+                 out_shift, out_scale,
+                 log_std,
+                 nonlinearity='tanh',
+                 min_log_std=-3):
+        """
+        :param weights:         list of layer weights, each of shape (out_dim, in_dim) (as in nn.Linear)
+        :param biases:          list of layer biases
+        :param in_shift:        observation shift (see utils/fc_network.py), and similarly the other transforms
+        :param log_std:         log standard deviation of the action noise
+        :param nonlinearity:    either 'tanh' or 'relu'
+        :param min_log_std:     log_std is clamped at this value and can't go below
+        """
+        self.n = weights[0].shape[1]    # number of states
+        self.m = weights[-1].shape[0]   # number of actions
+        self.nonlinearity = nonlinearity
+        self.min_log_std = min_log_std
+        self.set_transformations(in_shift, in_scale, out_shift, out_scale)
+        # same layout as the trainable params of the torch policies (so that params can be exchanged)
+        self.param_shapes = []
+        for w, b in zip(weights, biases):
+            self.param_shapes += [np.shape(w), np.shape(b)]
+        self.param_shapes.append(np.shape(log_std))
+        self.param_sizes = [int(np.prod(shape)) for shape in self.param_shapes]
+        self.d = np.sum(self.param_sizes)  # total number of params
+        self.set_param_values(np.concatenate([np.ravel(p) for wb in zip(weights, biases) for p in wb] +
+                                             [np.ravel(log_std)]))
+
+    @classmethod
+    def from_policy(cls, policy):
+        """
+        :param policy:  MLP or LinearPolicy (see gaussian_mlp.py and gaussian_linear.py)
+        """
+        model = policy.model
+        return cls([layer.weight.data.numpy() for layer in model.fc_layers],
+                   [layer.bias.data.numpy() for layer in model.fc_layers],
+                   *get_transformations(policy),
+                   log_std=policy.log_std.data.numpy(),
+                   nonlinearity='relu' if model.nonlinearity.__name__ == 'relu' else 'tanh',
+                   min_log_std=policy.min_log_std)
+
+    # Utility functions
+    # ============================================
+    def set_transformations(self, in_shift=None, in_scale=None, out_shift=None, out_scale=None):
+        # same as FCNetwork.set_transformations (e.g. after the input normalization of the learner changed)
+        self.in_shift = np.zeros(self.n, dtype=np.float32) if in_shift is None else np.float32(in_shift)
+        self.in_scale = np.ones(self.n, dtype=np.float32) if in_scale is None else np.float32(in_scale)
+        self.out_shift = np.zeros(self.m, dtype=np.float32) if out_shift is None else np.float32(out_shift)
+        self.out_scale = np.ones(self.m, dtype=np.float32) if out_scale is None else np.float32(out_scale)
+
+    def get_param_values(self):
+        return np.concatenate([np.ravel(p) for p in self.params])
+
+    def set_param_values(self, new_params, set_new=True, set_old=True):
+        # there is no old policy, set_old is only accepted for compatibility with the torch policies
+        if not set_new:
+            return
+        self.params = []
+        current_idx = 0
+        for idx, shape in enumerate(self.param_shapes):
+            vals = new_params[current_idx:current_idx + self.param_sizes[idx]]
+            # float32 copies, contiguous for the matmuls
+            self.params.append(np.array(vals.reshape(shape), dtype=np.float32))
+            current_idx += self.param_sizes[idx]
+        # clip std at minimum value
+        self.params[-1] = np.maximum(self.params[-1], np.float32(self.min_log_std))
+        self.log_std_val = np.float64(self.params[-1].ravel())
+        # weights are stored transposed, so that the forward pass is obs @ W
+        self.weights_t = [np.ascontiguousarray(w.T) for w in self.params[:-1:2]]
+        self.biases = self.params[1:-1:2]
+
+    # Main functions
+    # ============================================
+    def forward(self, observations):
+        out = (np.float32(observations) - self.in_shift) / (self.in_scale + np.float32(1e-8))
+        for i in range(len(self.weights_t)):
+            out = out.dot(self.weights_t[i])
+            out += self.biases[i]
+            if i < len(self.weights_t) - 1:
+                out = np.tanh(out, out=out) if self.nonlinearity == 'tanh' else np.maximum(out, 0, out=out)
+        return out * self.out_scale + self.out_shift
+
+    def get_action(self, observation, rng=None):
+        # rng: np.random.Generator for the action noise (global np.random if None)
+        mean = self.forward(observation.reshape(1, -1)).ravel()
+        rng = np.random if rng is None else rng
+        noise = np.exp(self.log_std_val) * rng.standard_normal(self.m)
+        action = mean + noise
+        return [action, {'mean': mean, 'log_std': self.log_std_val, 'evaluation': mean}]
+
+    def get_actions(self, observations, rngs=None):
+        # batched version of get_action: observations has shape (N, n)
+        # rngs: list of N np.random.Generator, one per row (global np.random if None)
+        mean = self.forward(observations.reshape(-1, self.n))
+        if rngs is None:
+            noise = np.random.standard_normal(mean.shape)
+        else:
+            noise = np.stack([rng.standard_normal(self.m) for rng in rngs])
+        action = mean + np.exp(self.log_std_val) * noise
+        log_std = np.broadcast_to(self.log_std_val, mean.shape)
+        return [action, {'mean': mean, 'log_std': log_std, 'evaluation': mean}]
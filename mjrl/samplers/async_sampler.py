@@ -0,0 +1,95 @@
+"""
+Pipelined sampling: the next batch of paths is collected in the background
+(with a snapshot of the policy) while the current batch is used for the update.
+Paths used for an update are hence collected with a policy that is up to
+max_policy_lag updates old. No off-policy correction is applied.
+"""
+
+import logging
+logging.disable(logging.CRITICAL)
+import copy
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncSampler:
+    def __init__(self, sampler, max_policy_lag=1):
+        """
+        :param sampler:         SamplerPool (see mjrl/samplers/worker_pool.py) used to collect the paths
+        :param max_policy_lag:  number of batches collected ahead of the updates (0 = synchronous sampling)
+        """
+        assert max_policy_lag >= 0
+        self.sampler = sampler
+        self.max_policy_lag = max_policy_lag
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = deque()
+        self.version = 0        # number of batches handed out so far (i.e. number of updates)
+        self.policy_lag = None  # lag of the last batch handed out
+
+    def start(self):
+        self.sampler.start()
+        return self
+
+    def stop(self):
+        # finish (and discard) the batches collected ahead
+        for future, _, _ in self.pending:
+            future.cancel()
+            try:
+                future.result()
+            except Exception:
+                pass
+        self.pending.clear()
+        self.executor.shutdown(wait=True)
+        self.sampler.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def sample_paths(self, num_traj, policy=None, eval_mode=False, horizon=1e6, base_seed=None, **kwargs):
+        """
+        Returns paths collected in the background with the policy parameters from (up to)
+        max_policy_lag calls ago, and starts collecting the next batch with the current parameters.
+        """
+        request = dict(eval_mode=eval_mode, horizon=horizon, **kwargs)
+        return self._get('sample_paths', num_traj, policy, base_seed, request)
+
+    def sample_data_batch(self, num_samples, policy=None, eval_mode=False, horizon=1e6, base_seed=None, **kwargs):
+        request = dict(eval_mode=eval_mode, horizon=horizon, **kwargs)
+        return self._get('sample_data_batch', num_samples, policy, base_seed, request)
+
+    def _launch(self, func_name, N, policy, base_seed, request):
+        # snapshot the policy so that the learner can update it while sampling
+        behavior_policy = copy.deepcopy(policy)
+        future = self.executor.submit(self._collect, func_name, N,
+                                      policy=behavior_policy, base_seed=base_seed, **request)
+        self.pending.append((future, func_name, self.version))
+
+    def _collect(self, func_name, N, **kwargs):
+        # runs in the background thread
+        paths = getattr(self.sampler, func_name)(N, **kwargs)
+        if self.sampler.path_buffers is not None:
+            # the shared memory buffers get overwritten by the next batch, which the (single)
+            # background thread only starts after this one has been copied out
+            paths = [copy.deepcopy(path) for path in paths]
+        return paths
+
+    def _get(self, func_name, N, policy, base_seed, request):
+        policy = self.sampler.policy if policy is None else policy
+        # seeds of the batches collected ahead follow the usual seed + N progression
+        seed_at = lambda k: None if base_seed is None else base_seed + k * N
+
+        if len(self.pending) == 0:
+            self._launch(func_name, N, policy, seed_at(0), request)
+        future, launched_func, launched_version = self.pending.popleft()
+        assert launched_func == func_name, "sampling mode changed while batches were pending"
+        paths = future.result()
+        self.policy_lag = self.version - launched_version
+
+        # the learner has not yet updated the policy with the paths being handed out
+        while len(self.pending) < self.max_policy_lag:
+            self._launch(func_name, N, policy, seed_at(len(self.pending) + 1), request)
+        self.version += 1
+        return paths
@@ -0,0 +1,310 @@
+"""
+Throughput benchmark for the samplers.
+Measures samples/sec of sample_paths, sample_data_batch, the persistent SamplerPool
+and model_accel policy_rollout (on a learned model) across num_cpu, horizon and
+policy size, a per-step latency breakdown (env step vs policy vs bookkeeping) of a
+single core rollout, and the scaling efficiency per core. sample_paths and sample_data_batch
+are timed with every backend (process / thread pool), and the fastest backend for every
+setting is reported. Results are printed and (optionally) written as json for regression tracking.
+
+USAGE:\n
+    $ python -m mjrl.samplers.benchmark --env standin --num_cpu 1,2,4 --horizon 100,500 --hidden_sizes 32-32,64-64 --output results.json\n
+    env can be 'standin' (pure numpy env, no mujoco required) or any registered env name (e.g. mjrl_point_mass-v0)
+"""
+
+import logging
+logging.disable(logging.CRITICAL)
+import copy
+import functools
+import json
+import os
+import platform
+import sys
+import time as timer
+import click
+import gym
+import numpy as np
+import torch
+from tabulate import tabulate
+import mjrl.envs
+from mjrl.utils.gym_env import GymEnv
+from mjrl.policies.gaussian_mlp import MLP
+from mjrl.samplers.core import sample_paths, sample_data_batch, do_rollout
+from mjrl.samplers.worker_pool import SamplerPool
+
+
+# Stand-in env (pure numpy, for machines without mujoco)
+# =======================================================
+class StandInEnvSpec(object):
+    def __init__(self, id, max_episode_steps):
+        self.id = id
+        self.max_episode_steps = max_episode_steps
+
+
+class StandInEnv(gym.Env):
+    """
+    Linear dynamics with a quadratic cost. Cheap to step, so that the benchmark
+    mostly measures the overheads of the samplers and the policy.
+    """
+    def __init__(self, obs_dim=10, act_dim=3, horizon=100):
+        self.env = self     # mimic the gym wrapper structure used by GymEnv
+        self.obs_dim, self.action_dim = obs_dim, act_dim
+        self.observation_space = gym.spaces.Box(low=-10.0, high=10.0, shape=(obs_dim,), dtype=np.float32)
+        self.action_space = gym.spaces.Box(low=-1.0, high=1.0, shape=(act_dim,), dtype=np.float32)
+        self.spec = StandInEnvSpec('mjrl_standin-v0', horizon)
+        dynamics_rng = np.random.RandomState(0)
+        self.A = np.eye(obs_dim) + 0.01 * dynamics_rng.randn(obs_dim, obs_dim)
+        self.B = 0.1 * dynamics_rng.randn(obs_dim, act_dim)
+        self.np_random = np.random.RandomState()
+        self.state = np.zeros(obs_dim)
+
+    def seed(self, seed=None):
+        self.np_random = np.random.RandomState(seed)
+        return [seed]
+
+    def reset_model(self, seed=None):
+        if seed is not None:
+            self.seed(seed)
+        self.state = self.np_random.uniform(low=-1.0, high=1.0, size=self.obs_dim)
+        return self.get_obs()
+
+    def reset(self):
+        return self.reset_model()
+
+    def step(self, a):
+        self.state = np.clip(self.A.dot(self.state) + self.B.dot(a), -10.0, 10.0)
+        reward = - np.sum(self.state ** 2) - 0.01 * np.sum(a ** 2)
+        return self.get_obs(), reward, False, self.get_env_infos()
+
+    def get_obs(self):
+        return self.state.copy()
+
+    def get_env_infos(self):
+        return dict(state_norm=np.linalg.norm(self.state))
+
+
+def make_standin_env(obs_dim=10, act_dim=3, horizon=100):
+    return GymEnv(StandInEnv(obs_dim=obs_dim, act_dim=act_dim, horizon=horizon))
+
+
+# Benchmarks
+# =======================================================
+def _get_env(env_name, horizon):
+    """
+    :return: env (str or factory function that can be sent to the workers), env_kwargs, and a local GymEnv
+    """
+    if env_name == 'standin':
+        env_kwargs = dict(horizon=int(horizon))
+        return make_standin_env, env_kwargs, make_standin_env(**env_kwargs)
+    return env_name, None, GymEnv(env_name)
+
+
+def _best_time(func, repeats):
+    # best of a few repeats is the least noisy estimate of the attainable throughput
+    times, num_samples = [], None
+    for _ in range(repeats):
+        t0 = timer.time()
+        paths = func()
+        times.append(timer.time() - t0)
+        num_samples = int(np.sum([p['rewards'].shape[0] for p in paths]))
+    return min(times), num_samples
+
+
+def rollout_breakdown(env, policy, num_traj, horizon, base_seed=123):
+    """
+    Single core rollout with the env and the policy instrumented.
+    :return: per-step latency (in micro seconds) of the env step, the policy and the
+             remaining bookkeeping (book keeping of the paths, seeding, resets)
+    """
+    timings = dict(env=0.0, policy=0.0)
+
+    def timed(func, key):
+        # wraps keeps the signature, so that do_rollout still finds the rng argument of get_action
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            t0 = timer.time()
+            out = func(*args, **kwargs)
+            timings[key] += timer.time() - t0
+            return out
+        return wrapper
+
+    env, policy = copy.deepcopy(env), copy.deepcopy(policy)
+    env.step = timed(env.step, 'env')
+    env.get_env_infos = timed(env.get_env_infos, 'env')
+    policy.get_action = timed(policy.get_action, 'policy')
+    t0 = timer.time()
+    paths = do_rollout(num_traj, env, policy, horizon=horizon, base_seed=base_seed)
+    total = timer.time() - t0
+    num_samples = np.sum([p['rewards'].shape[0] for p in paths])
+    to_us = 1e6 / num_samples
+    return dict(env_step_us=timings['env'] * to_us,
+                policy_us=timings['policy'] * to_us,
+                bookkeeping_us=(total - timings['env'] - timings['policy']) * to_us,
+                total_us=total * to_us)
+
+
+def time_policy_rollout(local_env, policy, num_traj, horizon, repeats=3, base_seed=123):
+    # batched rollouts on a learned model (see mjrl/algos/model_accel/sampling.py)
+    from mjrl.algos.model_accel.nn_dynamics import WorldModel
+    from mjrl.algos.model_accel.sampling import policy_rollout
+    learned_model = WorldModel(state_dim=local_env.observation_dim, act_dim=local_env.action_dim,
+                               hidden_size=(64, 64), seed=base_seed)
+    horizon = int(min(horizon, local_env.horizon))
+    times = []
+    for _ in range(repeats):
+        t0 = timer.time()
+        policy_rollout(num_traj, local_env, policy, learned_model, horizon=horizon, seed=base_seed)
+        times.append(timer.time() - t0)
+    return min(times), num_traj * horizon
+
+
+def run_benchmark(env_name='standin',
+                  num_cpus=(1, 2),
+                  horizons=(100,),
+                  hidden_sizes_list=((32, 32),),
+                  num_traj=None,
+                  repeats=3,
+                  model_rollouts=True,
+                  backends=('process', 'thread'),
+                  base_seed=123,
+                  ):
+    """
+    :param env_name:            'standin' or name of a registered env
+    :param num_cpus:            list of num_cpu values to benchmark
+    :param horizons:            list of horizons
+    :param hidden_sizes_list:   list of policy hidden sizes
+    :param num_traj:            trajectories per measurement (defaults to 4 per cpu of the largest num_cpu)
+    :param repeats:             number of repeats per measurement (best time is reported)
+    :param model_rollouts:      also benchmark model_accel policy_rollout
+    :param backends:            backends of sample_paths and sample_data_batch to benchmark
+    :return: list of result records (dicts)
+    """
+    num_traj = 4 * max(num_cpus) if num_traj is None else num_traj
+    results = []
+    for horizon in horizons:
+        env, env_kwargs, local_env = _get_env(env_name, horizon)
+        horizon = int(min(horizon, local_env.horizon))
+        for hidden_sizes in hidden_sizes_list:
+            policy = MLP(local_env.spec, hidden_sizes=tuple(hidden_sizes), seed=base_seed)
+            config = dict(env=env_name, horizon=horizon, hidden_sizes=list(hidden_sizes))
+
+            breakdown = rollout_breakdown(local_env, policy, num_traj, horizon, base_seed)
+            results.append(dict(benchmark='rollout_breakdown', num_cpu=1, **config, **breakdown))
+
+            benchmarks = [('sample_paths', b) for b in backends] + [('sample_data_batch', b) for b in backends]
+            for benchmark, backend in benchmarks + [('sampler_pool', 'process')]:
+                serial_rate = None
+                for num_cpu in num_cpus:
+                    if benchmark == 'sample_paths':
+                        func = lambda: sample_paths(num_traj, env, policy, horizon=horizon, base_seed=base_seed,
+                                                    num_cpu=num_cpu, env_kwargs=env_kwargs, suppress_print=True,
+                                                    backend=backend)
+                    elif benchmark == 'sample_data_batch':
+                        func = lambda: sample_data_batch(num_traj * horizon, env, policy, horizon=horizon,
+                                                         base_seed=base_seed, num_cpu=num_cpu, env_kwargs=env_kwargs,
+                                                         backend=backend, suppress_print=True)
+                    else:
+                        pool = SamplerPool(env, policy, num_cpu=num_cpu, env_kwargs=env_kwargs).start()
+                        func = lambda: pool.sample_paths(num_traj, horizon=horizon, base_seed=base_seed,
+                                                         suppress_print=True)
+                    elapsed, num_samples = _best_time(func, repeats)
+                    if benchmark == 'sampler_pool':
+                        pool.stop()
+                    rate = num_samples / elapsed
+                    serial_rate = rate if num_cpu == 1 else serial_rate
+                    efficiency = None if serial_rate is None else rate / (num_cpu * serial_rate)
+                    results.append(dict(benchmark=benchmark, backend=backend, num_cpu=num_cpu, **config,
+                                        num_samples=num_samples, time=elapsed, samples_per_sec=rate,
+                                        scaling_efficiency=efficiency))
+
+            if model_rollouts:
+                elapsed, num_samples = time_policy_rollout(local_env, policy, num_traj, horizon, repeats, base_seed)
+                results.append(dict(benchmark='policy_rollout', backend='serial', num_cpu=1, **config,
+                                    num_samples=num_samples, time=elapsed, samples_per_sec=num_samples / elapsed,
+                                    scaling_efficiency=None))
+    return results
+
+
+def system_info():
+    return dict(time=timer.strftime('%Y-%m-%d %H:%M:%S'), platform=platform.platform(),
+                python=sys.version.split()[0], numpy=np.__version__, torch=torch.__version__,
+                cpu_count=os.cpu_count(), torch_num_threads=torch.get_num_threads())
+
+
+def backend_guidance(results):
+    """
+    Fastest sample_paths backend for every setting. num_cpu = 1 runs serially with any backend,
+    so the serial throughput is the one of num_cpu = 1. Processes pay for startup and pickling
+    (worth it for expensive envs and long horizons), threads only pay for the GIL (worth it
+    when env stepping releases the GIL, e.g. mujoco, and the python overhead per step is small).
+    :return: list of dicts with the best backend and its speedup over serial sampling
+    """
+    records = [r for r in results if r['benchmark'] == 'sample_paths']
+    guidance = []
+    for r in records:
+        if r['num_cpu'] == 1 or any(g['horizon'] == r['horizon'] and g['hidden_sizes'] == r['hidden_sizes']
+                                    and g['num_cpu'] == r['num_cpu'] for g in guidance):
+            continue
+        same_setting = [s for s in records if s['horizon'] == r['horizon'] and s['hidden_sizes'] == r['hidden_sizes']]
+        serial = max(s['samples_per_sec'] for s in same_setting if s['num_cpu'] == 1) \
+            if any(s['num_cpu'] == 1 for s in same_setting) else None
+        best = max([s for s in same_setting if s['num_cpu'] == r['num_cpu']], key=lambda s: s['samples_per_sec'])
+        backend = best['backend'] if serial is None or best['samples_per_sec'] > serial else 'serial'
+        guidance.append(dict(horizon=r['horizon'], hidden_sizes=r['hidden_sizes'], num_cpu=r['num_cpu'],
+                             backend=backend, speedup=None if serial is None else best['samples_per_sec'] / serial))
+    return guidance
+
+
+def print_results(results):
+    throughput = [[r['benchmark'], r['backend'], r['horizon'], '-'.join(str(h) for h in r['hidden_sizes']),
+                   r['num_cpu'], '%.0f' % r['samples_per_sec'],
+                   '-' if r['scaling_efficiency'] is None else '%.2f' % r['scaling_efficiency']]
+                  for r in results if r['benchmark'] != 'rollout_breakdown']
+    print(tabulate(throughput, headers=['benchmark', 'backend', 'horizon', 'hidden', 'num_cpu',
+                                        'samples/sec', 'efficiency']))
+    print()
+    breakdown = [[r['horizon'], '-'.join(str(h) for h in r['hidden_sizes']), '%.1f' % r['env_step_us'],
+                  '%.1f' % r['policy_us'], '%.1f' % r['bookkeeping_us'], '%.1f' % r['total_us']]
+                 for r in results if r['benchmark'] == 'rollout_breakdown']
+    print(tabulate(breakdown, headers=['horizon', 'hidden', 'env (us/step)', 'policy (us/step)',
+                                       'bookkeeping (us/step)', 'total (us/step)']))
+    guidance = backend_guidance(results)
+    if len(guidance) > 0:
+        print()
+        print("Fastest sample_paths backend (speedup over serial sampling):")
+        print(tabulate([[g['horizon'], '-'.join(str(h) for h in g['hidden_sizes']), g['num_cpu'], g['backend'],
+                         '-' if g['speedup'] is None else '%.2fx' % g['speedup']] for g in guidance],
+                       headers=['horizon', 'hidden', 'num_cpu', 'backend', 'speedup']))
+
+
+def _parse_list(value, sep=','):
+    return [int(v) for v in value.split(sep)]
+
+
+DESC = __doc__
+
+
+@click.command(help=DESC)
+@click.option('--env', type=str, help="'standin' or name of a registered env", default='standin')
+@click.option('--num_cpu', type=str, help='comma separated list of num_cpu', default='1,2')
+@click.option('--horizon', type=str, help='comma separated list of horizons', default='100')
+@click.option('--hidden_sizes', type=str, help='comma separated list of policy sizes (e.g. 32-32,64-64)', default='32-32')
+@click.option('--num_traj', type=int, help='trajectories per measurement', default=None)
+@click.option('--repeats', type=int, help='repeats per measurement (best is reported)', default=3)
+@click.option('--model_rollouts/--no_model_rollouts', help='benchmark model_accel policy_rollout', default=True)
+@click.option('--backends', type=str, help='comma separated list of sampler backends (process, thread)', default='process,thread')
+@click.option('--output', type=str, help='json file to write the results to', default=None)
+def main(env, num_cpu, horizon, hidden_sizes, num_traj, repeats, model_rollouts, backends, output):
+    results = run_benchmark(env_name=env, num_cpus=_parse_list(num_cpu), horizons=_parse_list(horizon),
+                            hidden_sizes_list=[_parse_list(h, '-') for h in hidden_sizes.split(',')],
+                            num_traj=num_traj, repeats=repeats, model_rollouts=model_rollouts,
+                            backends=backends.split(','))
+    print_results(results)
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(dict(system=system_info(), results=results, backend_guidance=backend_guidance(results)),
+                      f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,123 @@
 import logging
+import copy
+import inspect
 import numpy as np
 from mjrl.utils.gym_env import GymEnv
 from mjrl.utils import tensor_utils
 logging.disable(logging.CRITICAL)
 import multiprocessing as mp
 import time as timer
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 logging.disable(logging.CRITICAL)
 
 
+def get_env(env, env_kwargs=None):
+    """
+    :param env:         environment (env class, str with env_name, or factory function)
+    :param env_kwargs:  dictionary with parameters, will be passed to env generator
+    :return:            env instance that can be stepped by the rollout functions
+    """
+    if type(env) == str:
+        env = GymEnv(env)
+    elif isinstance(env, GymEnv):
+        env = env
+    elif callable(env):
+        env_kwargs = dict() if env_kwargs is None else env_kwargs
+        env = env(**env_kwargs)
+    else:
+        print("Unsupported environment format")
+        raise AttributeError
+    return env
+
+
+def get_envs(env, num_envs, env_kwargs=None):
+    """
+    :param env:         environment (env class, str with env_name, or factory function)
+    :param num_envs:    number of env instances (int)
+    :param env_kwargs:  dictionary with parameters, will be passed to env generator
+    :return:            list of num_envs independent env instances. An env instance passed as env is
+                        used for the first slot and deep copied for the others (stepping the same
+                        instance in several slots would interleave their trajectories).
+    """
+    envs = [get_env(env, env_kwargs)]
+    for _ in range(num_envs - 1):
+        envs.append(copy.deepcopy(envs[0]) if isinstance(env, GymEnv) else get_env(env, env_kwargs))
+    return envs
+
+
+def get_rollout_rngs(seed=None):
+    """
+    Random streams for one trajectory, spawned from SeedSequence(seed). The env and the
+    policy noise get decorrelated streams, and the global np.random state is not used
+    (so that several samplers can run in one process).
+    :param seed:    seed of the trajectory (int, or None for fresh entropy)
+    :return:        seed for env.set_seed (None if seed is None), np.random.Generator for the policy noise
+    """
+    env_seq, policy_seq = np.random.SeedSequence(seed).spawn(2)
+    env_seed = None if seed is None else int(env_seq.generate_state(1)[0])
+    return env_seed, np.random.default_rng(policy_seq)
+
+
+def _accepts_arg(func, arg):
+    # policies that do not take an rng keep drawing their noise from the global np.random
+    try:
+        return arg in inspect.signature(func).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+class EnvInfoRecorder:
+    def __init__(self, keys=None, horizon=1e6):
+        """
+        Records the env_infos of a trajectory into preallocated arrays (grown if needed),
+        instead of keeping a dict per timestep and stacking them at the end.
+        :param keys:        env_info keys to record (None records all keys, [] records nothing)
+        :param horizon:     max trajectory length, used to size the arrays
+        """
+        self.keys = keys
+        self.capacity = int(min(horizon, 1000))
+        self.t = 0
+        self.data = None
+
+    @property
+    def enabled(self):
+        return self.keys is None or len(self.keys) > 0
+
+    def _allocate(self, value):
+        if isinstance(value, dict):
+            return {k: self._allocate(v) for k, v in value.items()}
+        value = np.asarray(value)
+        if value.dtype.kind not in 'biufc':
+            return []   # strings and objects are kept in a list
+        return np.zeros((self.capacity,) + value.shape, dtype=value.dtype)
+
+    def _write(self, data, value):
+        for k, v in value.items():
+            if isinstance(v, dict):
+                self._write(data[k], v)
+            elif type(data[k]) == list:
+                data[k].append(v)
+            else:
+                if self.t == data[k].shape[0]:
+                    data[k] = np.concatenate([data[k], np.zeros_like(data[k])])
+                data[k][self.t] = v
+
+    def append(self, env_info):
+        if self.keys is not None:
+            env_info = {k: env_info[k] for k in self.keys if k in env_info}
+        if self.data is None:
+            self.data = self._allocate(env_info)
+        self._write(self.data, env_info)
+        self.t += 1
+
+    def _truncate(self, data):
+        return {k: self._truncate(v) if isinstance(v, dict) else np.array(v) if type(v) == list else v[:self.t]
+                for k, v in data.items()}
+
+    def get(self):
+        return dict() if self.data is None else self._truncate(self.data)
+
+
 # Single core rollout to sample trajectories
 # =======================================================
 def do_rollout(
@@ -18,59 +128,51 @@ def do_rollout(
         horizon = 1e6,
         base_seed = None,
         env_kwargs=None,
+        env_info_keys=None,
 ):
     """
-    :param num_traj:    number of trajectories (int)
-    :param env:         environment (env class, str with env_name, or factory function)
-    :param policy:      policy to use for action selection
-    :param eval_mode:   use evaluation mode for action computation (bool)
-    :param horizon:     max horizon length for rollout (<= env.horizon)
-    :param base_seed:   base seed for rollouts (int)
-    :param env_kwargs:  dictionary with parameters, will be passed to env generator
+    :param num_traj:        number of trajectories (int)
+    :param env:             environment (env class, str with env_name, or factory function)
+    :param policy:          policy to use for action selection
+    :param eval_mode:       use evaluation mode for action computation (bool)
+    :param horizon:         max horizon length for rollout (<= env.horizon)
+    :param base_seed:       base seed for rollouts (int)
+    :param env_kwargs:      dictionary with parameters, will be passed to env generator
+    :param env_info_keys:   env_info keys to record (None records all, [] skips env_infos altogether)
     :return:
     """
 
     # get the correct env behavior
-    if type(env) == str:
-        env = GymEnv(env)
-    elif isinstance(env, GymEnv):
-        env = env
-    elif callable(env):
-        env = env(**env_kwargs)
-    else:
-        print("Unsupported environment format")
-        raise AttributeError
+    env = get_env(env, env_kwargs)
+    use_rng = _accepts_arg(policy.get_action, 'rng')
 
-    if base_seed is not None:
-        env.set_seed(base_seed)
-        np.random.seed(base_seed)
-    else:
-        np.random.seed()
     horizon = min(horizon, env.horizon)
     paths = []
 
     for ep in range(num_traj):
-        # seeding
-        if base_seed is not None:
-            seed = base_seed + ep
-            env.set_seed(seed)
+        # seeding (trajectory ep uses the streams of seed base_seed + ep, irrespective of the worker)
+        seed = None if base_seed is None else base_seed + ep
+        env_seed, rng = get_rollout_rngs(seed)
+        if env_seed is not None:
+            env.set_seed(env_seed)
+        if not use_rng:
             np.random.seed(seed)
 
         observations=[]
         actions=[]
         rewards=[]
         agent_infos = []
-        env_infos = []
+        env_infos = EnvInfoRecorder(env_info_keys, horizon)
 
         o = env.reset()
         done = False
         t = 0
 
         while t < horizon and done != True:
-            a, agent_info = policy.get_action(o)
+            a, agent_info = policy.get_action(o, rng=rng) if use_rng else policy.get_action(o)
             if eval_mode:
                 a = agent_info['evaluation']
-            env_info_base = env.get_env_infos()
+            env_info_base = env.get_env_infos() if env_infos.enabled else {}
             next_o, r, done, env_info_step = env.step(a)
             # below is important to ensure correct env_infos for the timestep
             env_info = env_info_step if env_info_base == {} else env_info_base
@@ -78,7 +180,7 @@ def do_rollout(
             actions.append(a)
             rewards.append(r)
             agent_infos.append(agent_info)
-            env_infos.append(env_info)
+            if env_infos.enabled: env_infos.append(env_info)
             o = next_o
             t += 1
 
@@ -87,7 +189,7 @@ def do_rollout(
             actions=np.array(actions),
             rewards=np.array(rewards),
             agent_infos=tensor_utils.stack_tensor_dict_list(agent_infos),
-            env_infos=tensor_utils.stack_tensor_dict_list(env_infos),
+            env_infos=env_infos.get(),
             terminated=done
         )
         paths.append(path)
@@ -96,6 +198,104 @@ def do_rollout(
     return paths
 
 
+# Single core rollout with several envs stepped in lock-step
+# =======================================================
+def do_vectorized_rollout(
+        num_traj,
+        env,
+        policy,
+        num_envs = 4,
+        eval_mode = False,
+        horizon = 1e6,
+        base_seed = None,
+        env_kwargs=None,
+        env_info_keys=None,
+):
+    """
+    Holds num_envs environments and queries the policy once per timestep with the
+    stacked observations of all the active envs (uses policy.get_actions).
+    Returns the paths in the same format (and order of seeds) as do_rollout.
+    :param num_traj:        number of trajectories (int)
+    :param env:             environment (str with env_name, factory function, env instance, or list of env instances)
+    :param policy:          policy to use for action selection (must support batched get_actions)
+    :param num_envs:        number of environments to step together (int)
+    :param eval_mode:       use evaluation mode for action computation (bool)
+    :param horizon:         max horizon length for rollout (<= env.horizon)
+    :param base_seed:       base seed for rollouts (int)
+    :param env_kwargs:      dictionary with parameters, will be passed to env generator
+    :param env_info_keys:   env_info keys to record (None records all, [] skips env_infos altogether)
+    :return:
+    """
+
+    # get the correct env behavior
+    if type(env) == list or type(env) == tuple:
+        envs = list(env)
+    else:
+        envs = get_envs(env, min(num_envs, num_traj), env_kwargs)
+    use_rng = _accepts_arg(policy.get_actions, 'rngs')
+
+    if not use_rng:
+        np.random.seed(base_seed)
+    horizon = min(horizon, envs[0].horizon)
+    paths = [None] * num_traj
+
+    # per env buffers for the trajectory currently being collected
+    slots = [None] * len(envs)
+    next_ep = 0
+
+    def start_episode(k):
+        nonlocal next_ep
+        if next_ep >= num_traj:
+            slots[k] = None
+            return
+        env_seed, rng = get_rollout_rngs(None if base_seed is None else base_seed + next_ep)
+        if env_seed is not None:
+            envs[k].set_seed(env_seed)
+        slots[k] = dict(ep=next_ep, rng=rng, o=envs[k].reset(), t=0, observations=[], actions=[],
+                        rewards=[], agent_infos=[], env_infos=EnvInfoRecorder(env_info_keys, horizon))
+        next_ep += 1
+
+    for k in range(len(envs)):
+        start_episode(k)
+
+    while any(slot is not None for slot in slots):
+        active = [k for k in range(len(envs)) if slots[k] is not None]
+        obs = np.stack([slots[k]['o'] for k in active])
+        if use_rng:
+            acts, agent_info = policy.get_actions(obs, rngs=[slots[k]['rng'] for k in active])
+        else:
+            acts, agent_info = policy.get_actions(obs)
+        if eval_mode:
+            acts = agent_info['evaluation']
+
+        for j, k in enumerate(active):
+            slot, a = slots[k], acts[j]
+            env_info_base = envs[k].get_env_infos() if slot['env_infos'].enabled else {}
+            next_o, r, done, env_info_step = envs[k].step(a)
+            # below is important to ensure correct env_infos for the timestep
+            env_info = env_info_step if env_info_base == {} else env_info_base
+            slot['observations'].append(slot['o'])
+            slot['actions'].append(a)
+            slot['rewards'].append(r)
+            slot['agent_infos'].append({key: val[j] for key, val in agent_info.items()})
+            if slot['env_infos'].enabled: slot['env_infos'].append(env_info)
+            slot['o'] = next_o
+            slot['t'] += 1
+
+            if done == True or slot['t'] >= horizon:
+                paths[slot['ep']] = dict(
+                    observations=np.array(slot['observations']),
+                    actions=np.array(slot['actions']),
+                    rewards=np.array(slot['rewards']),
+                    agent_infos=tensor_utils.stack_tensor_dict_list(slot['agent_infos']),
+                    env_infos=slot['env_infos'].get(),
+                    terminated=done
+                )
+                start_episode(k)
+
+    return paths
+
+
 def sample_paths(
         num_traj,
         env,
@@ -108,34 +308,54 @@ def sample_paths(
         max_timeouts=4,
         suppress_print=False,
         env_kwargs=None,
+        envs_per_worker=1,
+        env_info_keys=None,
+        backend='process',
         ):
+    """
+    :param backend:     'process' (pool of worker processes), 'thread' (pool of threads in this process,
+                        one env instance per task) or 'serial'. Threads avoid the process startup and
+                        pickling costs, and run in parallel as long as the env releases the GIL (e.g.
+                        mujoco stepping). See mjrl/samplers/benchmark.py to pick one for an env.
+                        Threads are reproducible only with policies that take an rng (see do_rollout).
+    """
 
     num_cpu = 1 if num_cpu is None else num_cpu
     num_cpu = mp.cpu_count() if num_cpu == 'max' else num_cpu
     assert type(num_cpu) == int
+    assert backend in ['process', 'thread', 'serial']
 
-    if num_cpu == 1:
+    # step several envs per worker with batched policy queries if requested
+    rollout_func = do_rollout if envs_per_worker == 1 else do_vectorized_rollout
+    vec_kwargs = dict() if envs_per_worker == 1 else dict(num_envs=envs_per_worker)
+
+    if num_cpu == 1 or backend == 'serial':
         input_dict = dict(num_traj=num_traj, env=env, policy=policy,
                           eval_mode=eval_mode, horizon=horizon, base_seed=base_seed,
-                          env_kwargs=env_kwargs)
+                          env_kwargs=env_kwargs, env_info_keys=env_info_keys, **vec_kwargs)
         # dont invoke multiprocessing if not necessary
-        return do_rollout(**input_dict)
+        return rollout_func(**input_dict)
 
     # do multiprocessing otherwise
+    # env and policy are handed to the workers once (inherited when forked), not pickled with every task
+    worker_kwargs = dict(env=env, policy=policy, env_kwargs=env_kwargs)
     paths_per_cpu = int(np.ceil(num_traj/num_cpu))
     input_dict_list= []
     for i in range(num_cpu):
-        input_dict = dict(num_traj=paths_per_cpu, env=env, policy=policy,
-                          eval_mode=eval_mode, horizon=horizon,
-                          base_seed=base_seed + i * paths_per_cpu,
-                          env_kwargs=env_kwargs)
+        input_dict = dict(num_traj=paths_per_cpu, eval_mode=eval_mode, horizon=horizon,
+                          base_seed=None if base_seed is None else base_seed + i * paths_per_cpu,
+                          env_info_keys=env_info_keys, **vec_kwargs)
         input_dict_list.append(input_dict)
     if suppress_print is False:
         start_time = timer.time()
         print("####### Gathering Samples #######")
 
-    results = _try_multiprocess(do_rollout, input_dict_list,
-                                num_cpu, max_process_time, max_timeouts)
+    if backend == 'thread':
+        results = _try_threads(rollout_func, input_dict_list,
+                               num_cpu, max_process_time, max_timeouts, worker_kwargs)
+    else:
+        results = _try_multiprocess(rollout_func, input_dict_list,
+                                    num_cpu, max_process_time, max_timeouts, worker_kwargs)
     paths = []
     # result is a paths type and results is list of paths
     for result in results:
@@ -158,53 +378,179 @@ def sample_data_batch(
         num_cpu = 1,
         paths_per_call = 1,
         env_kwargs=None,
+        envs_per_worker=1,
+        env_info_keys=None,
+        backend='process',
+        suppress_print=False,
         ):
 
     num_cpu = 1 if num_cpu is None else num_cpu
     num_cpu = mp.cpu_count() if num_cpu == 'max' else num_cpu
     assert type(num_cpu) == int
 
+    # imported here since worker_pool builds on the functions in this file
+    from mjrl.samplers.worker_pool import SamplerPool, _num_prefix_tasks
+    if num_cpu > 1 and backend == 'process':
+        # hand out trajectories to the workers on demand instead of in rounds of num_cpu
+        with SamplerPool(env, policy, num_cpu=num_cpu, env_kwargs=env_kwargs,
+                         envs_per_worker=envs_per_worker) as sampler:
+            return sampler.sample_data_batch(num_samples, eval_mode=eval_mode, horizon=horizon,
+                                             base_seed=base_seed, paths_per_call=paths_per_call,
+                                             suppress_print=suppress_print, env_info_keys=env_info_keys)
+
     start_time = timer.time()
-    print("####### Gathering Samples #######")
-    sampled_so_far = 0
-    paths_so_far = 0
-    paths = []
+    if suppress_print is False:
+        print("####### Gathering Samples #######")
+    # same seed schedule as SamplerPool.sample_data_batch (so that the paths do not depend on num_cpu
+    # or backend): call j collects paths_per_call trajectories, trajectory i is seeded with base_seed + i,
+    # and the shortest prefix of calls with num_samples samples is returned
     base_seed = 123 if base_seed is None else base_seed
-    while sampled_so_far < num_samples:
-        base_seed = base_seed + 12345
+    results = dict()
+    while _num_prefix_tasks(results, num_samples) is None:
         new_paths = sample_paths(paths_per_call * num_cpu, env, policy,
-                                 eval_mode, horizon, base_seed, num_cpu,
-                                 suppress_print=True, env_kwargs=env_kwargs)
-        for path in new_paths:
-            paths.append(path)
-        paths_so_far += len(new_paths)
-        new_samples = np.sum([len(p['rewards']) for p in new_paths])
-        sampled_so_far += new_samples
-    print("======= Samples Gathered  ======= | >>>> Time taken = %f " % (timer.time() - start_time))
-    print("................................. | >>>> # samples = %i # trajectories = %i " % (
-    sampled_so_far, paths_so_far))
+                                 eval_mode, horizon, base_seed + len(results) * paths_per_call, num_cpu,
+                                 suppress_print=True, env_kwargs=env_kwargs,
+                                 envs_per_worker=envs_per_worker, env_info_keys=env_info_keys,
+                                 backend=backend)
+        for i in range(num_cpu):
+            results[len(results)] = new_paths[i * paths_per_call:(i + 1) * paths_per_call]
+    paths = [path for j in range(_num_prefix_tasks(results, num_samples)) for path in results[j]]
+    sampled_so_far, paths_so_far = int(np.sum([len(p['rewards']) for p in paths])), len(paths)
+    if suppress_print is False:
+        print("======= Samples Gathered  ======= | >>>> Time taken = %f " % (timer.time() - start_time))
+        print("................................. | >>>> # samples = %i # trajectories = %i " % (
+        sampled_so_far, paths_so_far))
     return paths
 
 
-def _try_multiprocess(func, input_dict_list, num_cpu, max_process_time, max_timeouts):
-    
-    # Base case
-    if max_timeouts == 0:
-        return None
+def iter_paths(
+        num_traj,
+        env,
+        policy,
+        eval_mode = False,
+        horizon = 1e6,
+        base_seed = None,
+        num_cpu = 1,
+        env_kwargs=None,
+        env_info_keys=None,
+        ordered=True,
+        ):
+    """
+    Generator version of sample_paths: yields the paths one at a time as soon as they are finished,
+    so that they can be processed (or saved) while the rest are collected, without holding all of
+    them in memory (e.g. when generating a large number of demos).
+    Trajectory j is seeded with base_seed + j, so the paths match sample_paths with the same base_seed.
+    :param ordered:     yield the paths in the order of j (else in the order in which they finish)
+    """
+    num_cpu = 1 if num_cpu is None else num_cpu
+    num_cpu = mp.cpu_count() if num_cpu == 'max' else num_cpu
+    assert type(num_cpu) == int
+
+    # (imported here since worker_pool builds on the functions in this file)
+    from mjrl.samplers.worker_pool import SamplerPool
+    with SamplerPool(env, policy, num_cpu=num_cpu, env_kwargs=env_kwargs) as sampler:
+        for path in sampler.iter_paths(num_traj, eval_mode=eval_mode, horizon=horizon, base_seed=base_seed,
+                                       env_info_keys=env_info_keys, ordered=ordered):
+            yield path
+
 
-    pool = mp.Pool(processes=num_cpu, maxtasksperchild=1)
-    parallel_runs = [pool.apply_async(func, kwds=input_dict) for input_dict in input_dict_list]
-    try:
-        results = [p.get(timeout=max_process_time) for p in parallel_runs]
-    except Exception as e:
-        print(str(e))
-        print("Timeout Error raised... Trying again")
+_worker_kwargs = dict()
+
+
+def _set_worker_kwargs(kwargs):
+    # pool initializer: stores the arguments shared by all the tasks of the worker
+    global _worker_kwargs
+    _worker_kwargs = kwargs
+
+
+def _call_with_worker_kwargs(func, input_dict):
+    return func(**input_dict, **_worker_kwargs)
+
+
+def _try_multiprocess(func, input_dict_list, num_cpu, max_process_time, max_timeouts, worker_kwargs=None):
+    """
+    Runs func on every input dict in a process pool. Tasks that raise or run longer than
+    max_process_time are retried on their own (in a fresh pool) while the results of the
+    other tasks are kept. Raises a RuntimeError listing the failures once a task has been
+    attempted max_timeouts times.
+    worker_kwargs (e.g. env and policy) are passed to every call of func, but are handed to
+    each worker process once (through the pool initializer) instead of with every task.
+    """
+    results = [None] * len(input_dict_list)
+    pending = list(range(len(input_dict_list)))
+    failures = []
+
+    for attempt in range(1, max_timeouts + 1):
+        pool = mp.Pool(processes=num_cpu, maxtasksperchild=1,
+                       initializer=_set_worker_kwargs, initargs=(dict() if worker_kwargs is None else worker_kwargs,))
+        parallel_runs = {idx: pool.apply_async(_call_with_worker_kwargs, (func, input_dict_list[idx]))
+                         for idx in pending}
+        deadline = timer.time() + max_process_time
+        failed = []
+        for idx in pending:
+            try:
+                results[idx] = parallel_runs[idx].get(timeout=max(deadline - timer.time(), 0))
+            except mp.TimeoutError:
+                failed.append(idx)
+                failures.append("task %i (attempt %i): timed out after %i seconds" % (idx, attempt, max_process_time))
+            except Exception as e:
+                failed.append(idx)
+                failures.append("task %i (attempt %i): %s: %s" % (idx, attempt, type(e).__name__, str(e)))
         pool.close()
         pool.terminate()
         pool.join()
-        return _try_multiprocess(func, input_dict_list, num_cpu, max_process_time, max_timeouts-1)
 
-    pool.close()
-    pool.terminate()
-    pool.join()  
-    return results
+        if len(failed) == 0:
+            return results
+        print(failures[-1])
+        print("%i of %i sampling tasks failed... Retrying only those" % (len(failed), len(input_dict_list)))
+        pending = failed
+
+    raise RuntimeError("Sampling failed after %i attempts. Failures:\n%s" % (max_timeouts, '\n'.join(failures)))
+
+
+def _try_threads(func, input_dict_list, num_cpu, max_process_time, max_timeouts, worker_kwargs=None):
+    """
+    Thread pool version of _try_multiprocess. Every task gets its own env instance (envs are not
+    thread safe) while the policy is shared (get_action only reads the parameters). Tasks that
+    raise are retried on their own. Threads can not be stopped, so a task that runs longer than
+    max_process_time raises a RuntimeError right away (the thread is abandoned).
+    """
+    worker_kwargs = dict() if worker_kwargs is None else worker_kwargs
+    env = worker_kwargs.get('env', None)
+
+    def run_task(input_dict):
+        kwargs = dict(worker_kwargs)
+        if isinstance(env, GymEnv):
+            kwargs['env'] = copy.deepcopy(env)
+        return func(**input_dict, **kwargs)
+
+    results = [None] * len(input_dict_list)
+    pending = list(range(len(input_dict_list)))
+    failures = []
+    executor = ThreadPoolExecutor(max_workers=num_cpu)
+    try:
+        for attempt in range(1, max_timeouts + 1):
+            parallel_runs = {idx: executor.submit(run_task, input_dict_list[idx]) for idx in pending}
+            deadline = timer.time() + max_process_time
+            failed = []
+            for idx in pending:
+                try:
+                    results[idx] = parallel_runs[idx].result(timeout=max(deadline - timer.time(), 0))
+                except FutureTimeoutError:
+                    raise RuntimeError("Sampling task %i timed out after %i seconds (threads can not be restarted)"
+                                       % (idx, max_process_time))
+                except Exception as e:
+                    failed.append(idx)
+                    failures.append("task %i (attempt %i): %s: %s" % (idx, attempt, type(e).__name__, str(e)))
+
+            if len(failed) == 0:
+                return results
+            print(failures[-1])
+            print("%i of %i sampling tasks failed... Retrying only those" % (len(failed), len(input_dict_list)))
+            pending = failed
+    finally:
+        # dont wait for abandoned (timed out) threads
+        executor.shutdown(wait=False)
+
+    raise RuntimeError("Sampling failed after %i attempts. Failures:\n%s" % (max_timeouts, '\n'.join(failures)))
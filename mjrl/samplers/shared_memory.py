@@ -0,0 +1,153 @@
+"""
+Shared memory transport between the rollout workers and the main process.
+Buffers are allocated by the parent before the workers are started (so that
+they are inherited) and are mapped as numpy arrays on both sides.
+"""
+
+import numpy as np
+import multiprocessing as mp
+
+
+class SharedPathBuffer:
+    def __init__(self, capacity, obs_dim, act_dim, agent_info_shapes=None):
+        """
+        Preallocated storage for the paths collected by one worker.
+        :param capacity:            max number of samples (timesteps) that can be stored
+        :param obs_dim:             observation dimension
+        :param act_dim:             action dimension
+        :param agent_info_shapes:   dict of {key: per-timestep shape} for the agent_infos
+        """
+        self.capacity = int(capacity)
+        agent_info_shapes = dict() if agent_info_shapes is None else agent_info_shapes
+        self.shapes = dict(observations=(obs_dim,), actions=(act_dim,), rewards=())
+        self.agent_info_keys = list(agent_info_shapes.keys())
+        for k, shape in agent_info_shapes.items():
+            self.shapes['agent_infos/' + k] = tuple(shape)
+        self.raw = {k: mp.RawArray('d', self.capacity * int(np.prod(shape)))
+                    for k, shape in self.shapes.items()}
+        self._views = None
+
+    @property
+    def views(self):
+        # numpy arrays backed by the shared memory (built lazily in each process)
+        if self._views is None:
+            self._views = {k: np.frombuffer(self.raw[k], dtype=np.float64).reshape((self.capacity,) + shape)
+                           for k, shape in self.shapes.items()}
+        return self._views
+
+    def _fits(self, path, offset):
+        T = path['rewards'].shape[0]
+        if offset + T > self.capacity:
+            return False
+        if path['observations'].shape[1:] != self.shapes['observations'] or \
+           path['actions'].shape[1:] != self.shapes['actions']:
+            return False
+        agent_infos = path.get('agent_infos', dict())
+        if sorted(agent_infos.keys()) != sorted(self.agent_info_keys):
+            return False
+        return all(agent_infos[k].shape[1:] == self.shapes['agent_infos/' + k] for k in self.agent_info_keys)
+
+    def write(self, paths, offset=0):
+        """
+        Called in the worker. Copies the paths into the buffer starting at offset.
+        :return: a compact description of the paths which can be sent to the parent.
+                 index has one row (start, length, terminated) per path (start = -1 if it did not fit
+                 in the buffer, in which case the path is included in overflow as is).
+        """
+        views = self.views
+        index = np.zeros((len(paths), 3), dtype=np.int64)
+        env_infos, overflow = [], dict()
+        for i, path in enumerate(paths):
+            T = path['rewards'].shape[0]
+            if not self._fits(path, offset):
+                index[i] = (-1, T, path['terminated'])
+                overflow[i] = path
+                env_infos.append(None)
+                continue
+            views['observations'][offset:offset+T] = path['observations']
+            views['actions'][offset:offset+T] = path['actions']
+            views['rewards'][offset:offset+T] = path['rewards']
+            for k in self.agent_info_keys:
+                views['agent_infos/' + k][offset:offset+T] = path['agent_infos'][k]
+            index[i] = (offset, T, path['terminated'])
+            env_infos.append(path.get('env_infos', dict()))
+            offset += T
+        return dict(index=index, env_infos=env_infos, overflow=overflow, end=offset)
+
+    def read(self, result):
+        """
+        Called in the parent. Rebuilds the paths from the output of write.
+        Paths are views into the shared memory, and are only valid till the buffer is written again.
+        """
+        views = self.views
+        paths = []
+        for i, (start, T, terminated) in enumerate(result['index']):
+            if start < 0:
+                paths.append(result['overflow'][i])
+                continue
+            path = dict(
+                observations=views['observations'][start:start+T],
+                actions=views['actions'][start:start+T],
+                rewards=views['rewards'][start:start+T],
+                agent_infos={k: views['agent_infos/' + k][start:start+T] for k in self.agent_info_keys},
+                env_infos=result['env_infos'][i],
+                terminated=bool(terminated),
+            )
+            paths.append(path)
+        return paths
+
+
+class SharedParamBuffer:
+    def __init__(self, num_params, obs_dim=0, act_dim=0):
+        """
+        Policy parameters broadcast to all the workers. The parent writes the flat parameter
+        vector and the model transformations (and bumps the version) once per call, and the tasks
+        only carry the version. Workers load both into their policy when the version has changed.
+        :param num_params:  size of the flat parameter vector (policy.get_param_values())
+        :param obs_dim:     size of in_shift and in_scale of the model (0 to only send the params)
+        :param act_dim:     size of out_shift and out_scale of the model
+        """
+        self.num_params = int(num_params)
+        self.obs_dim, self.act_dim = int(obs_dim), int(act_dim)
+        self.transformation_sizes = [self.obs_dim, self.obs_dim, self.act_dim, self.act_dim] if obs_dim > 0 else []
+        # stored as float64, so that loading into the (float32) torch params always copies
+        self.raw = mp.RawArray('d', self.num_params + int(np.sum(self.transformation_sizes)))
+        self.raw_version = mp.RawValue('l', 0)
+        self._view = None
+
+    @property
+    def view(self):
+        if self._view is None:
+            self._view = np.frombuffer(self.raw, dtype=np.float64)
+        return self._view
+
+    @property
+    def version(self):
+        return self.raw_version.value
+
+    def write(self, params, transformations=None):
+        """
+        Called in the parent, while no worker is running a task.
+        :param transformations:     (in_shift, in_scale, out_shift, out_scale) of the model (if sent)
+        :return: the new version
+        """
+        self.view[:self.num_params] = params
+        if len(self.transformation_sizes) > 0:
+            self.view[self.num_params:] = np.concatenate([np.ravel(t) for t in transformations])
+        self.raw_version.value += 1
+        return self.raw_version.value
+
+    def read_into(self, policy, version):
+        """
+        Called in the worker. Loads the parameters into the policy (new params only).
+        :param version:     version the task was dispatched with
+        """
+        assert version == self.version, "parameters were overwritten while the task was pending"
+        policy.set_param_values(self.view[:self.num_params], set_new=True, set_old=False)
+        if len(self.transformation_sizes) > 0:
+            offsets = self.num_params + np.cumsum([0] + self.transformation_sizes)
+            # copies, the model keeps references to the arrays it is given
+            transformations = [self.view[offsets[i]:offsets[i+1]].copy() for i in range(4)]
+            # torch policies keep the transformations in their model, NumpyPolicy in itself
+            model = getattr(policy, 'model', policy)
+            model.set_transformations(*transformations)
@@ -0,0 +1,478 @@
+"""
+Persistent pool of rollout workers.
+Workers build their env and a copy of the policy once, keep them alive across
+iterations, and only load the updated policy parameters (broadcast through shared
+memory, with the model transformations) when they change.
+"""
+
+import logging
+logging.disable(logging.CRITICAL)
+import numpy as np
+import multiprocessing as mp
+import time as timer
+import traceback
+from mjrl.samplers.core import do_rollout, do_vectorized_rollout, get_envs
+from mjrl.samplers.shared_memory import SharedPathBuffer, SharedParamBuffer
+from mjrl.policies.numpy_policy import NumpyPolicy, get_transformations
+
+
+def _make_envs(env, env_kwargs, envs_per_worker):
+    envs = get_envs(env, envs_per_worker, env_kwargs)
+    return envs[0] if envs_per_worker == 1 else envs
+
+
+def _rollout(envs, policy, rollout_kwargs):
+    if type(envs) == list:
+        return do_vectorized_rollout(env=envs, policy=policy, **rollout_kwargs)
+    return do_rollout(env=envs, policy=policy, **rollout_kwargs)
+
+
+def _worker_loop(conn, env, policy, env_kwargs, envs_per_worker, param_buffer, path_buffer=None):
+    # runs inside the worker process till the parent asks it to close
+    envs = _make_envs(env, env_kwargs, envs_per_worker)
+    param_version = None
+    while True:
+        try:
+            cmd, data = conn.recv()
+        except EOFError:
+            break
+        if cmd == 'close':
+            break
+        try:
+            version, rollout_kwargs, buffer_offset = data
+            if version != param_version:
+                param_buffer.read_into(policy, version)
+                param_version = version
+            ts = timer.time()
+            result = _rollout(envs, policy, rollout_kwargs)
+            if path_buffer is not None:
+                # only the index and env_infos go through the pipe
+                result = path_buffer.write(result, buffer_offset)
+            conn.send(('ok', result, timer.time() - ts))
+        except Exception:
+            conn.send(('error', traceback.format_exc(), 0.0))
+    conn.close()
+
+
+class SamplerPool:
+    def __init__(self, env, policy,
+                 num_cpu='max',
+                 env_kwargs=None,
+                 max_process_time=300,
+                 max_timeouts=4,
+                 envs_per_worker=1,
+                 shm_capacity=None,
+                 numpy_inference=False,
+                 ):
+        """
+        :param env:                 environment (env class, str with env_name, or factory function)
+        :param policy:              policy whose copy is kept in every worker (only params and transformations are sent later)
+        :param num_cpu:             number of worker processes (int or 'max'). 1 runs in the main process
+        :param env_kwargs:          dictionary with parameters, will be passed to env generator
+        :param max_process_time:    time (in seconds) a worker can take for one task before it is restarted
+        :param max_timeouts:        number of attempts for every task (failed tasks are retried on their own)
+        :param envs_per_worker:     envs stepped together (with batched policy queries) in every worker
+        :param shm_capacity:        if not None, workers write the paths into shared memory buffers that can
+                                    hold these many samples per worker (per call), instead of pickling them.
+                                    Paths returned are then views which are valid till the next call.
+        :param numpy_inference:     roll out a torch-free copy of the policy (see policies/numpy_policy.py),
+                                    which is faster for small networks
+        """
+        num_cpu = 1 if num_cpu is None else num_cpu
+        num_cpu = mp.cpu_count() if num_cpu == 'max' else num_cpu
+        assert type(num_cpu) == int
+
+        self.env = env
+        self.env_kwargs = env_kwargs
+        self.policy = policy
+        # policy skeleton used for the rollouts (the params are loaded into it with every call)
+        self.rollout_policy = NumpyPolicy.from_policy(policy) if numpy_inference else policy
+        self.num_cpu = num_cpu
+        self.max_process_time = max_process_time
+        self.max_timeouts = max_timeouts
+        self.envs_per_worker = envs_per_worker
+        self.shm_capacity = shm_capacity
+        self.param_buffer = None
+        self.path_buffers = None
+        self.buffer_offsets = None
+        self.outstanding = []
+        self.stats = None
+        self.failures = []
+        self.workers = []
+        self.conns = []
+        self.local_envs = None
+
+    # Lifecycle
+    # ============================================
+    @property
+    def is_running(self):
+        return self.local_envs is not None or len(self.workers) > 0
+
+    def start(self):
+        if self.is_running:
+            return self
+        if self.num_cpu == 1:
+            # dont invoke multiprocessing if not necessary
+            self.local_envs = _make_envs(self.env, self.env_kwargs, self.envs_per_worker)
+            return self
+        if self.param_buffer is None:
+            self.param_buffer = SharedParamBuffer(self.policy.get_param_values().shape[0],
+                                                  self.policy.n, self.policy.m)
+        if self.shm_capacity is not None and self.path_buffers is None:
+            agent_info_shapes = self._agent_info_shapes()
+            self.path_buffers = [SharedPathBuffer(self.shm_capacity, self.policy.n, self.policy.m,
+                                                  agent_info_shapes) for _ in range(self.num_cpu)]
+        self.workers = [None] * self.num_cpu
+        self.conns = [None] * self.num_cpu
+        for i in range(self.num_cpu):
+            self._start_worker(i)
+        return self
+
+    def _start_worker(self, i):
+        parent_conn, child_conn = mp.Pipe()
+        path_buffer = None if self.path_buffers is None else self.path_buffers[i]
+        worker = mp.Process(target=_worker_loop,
+                            args=(child_conn, self.env, self.rollout_policy, self.env_kwargs,
+                                  self.envs_per_worker, self.param_buffer, path_buffer),
+                            daemon=True)
+        worker.start()
+        child_conn.close()
+        self.workers[i] = worker
+        self.conns[i] = parent_conn
+
+    def _stop_worker(self, i, kill=False):
+        if not kill:
+            try:
+                self.conns[i].send(('close', None))
+            except (BrokenPipeError, EOFError, OSError):
+                pass
+            self.workers[i].join(timeout=5)
+        if self.workers[i].is_alive():
+            self.workers[i].terminate()
+            self.workers[i].join()
+        self.conns[i].close()
+
+    def _restart_worker(self, i):
+        # used for stuck or crashed workers, the other workers are left untouched
+        self._stop_worker(i, kill=True)
+        self._start_worker(i)
+
+    def stop(self):
+        for i in range(len(self.workers)):
+            self._stop_worker(i)
+        self.workers, self.conns = [], []
+        self.outstanding = []
+        self.local_envs = None
+
+    def _agent_info_shapes(self):
+        # query the policy once to know the agent_infos layout (without disturbing the global rng)
+        rng_state = np.random.get_state()
+        _, agent_info = self.policy.get_action(np.zeros(self.policy.n))
+        np.random.set_state(rng_state)
+        return {k: np.shape(v) for k, v in agent_info.items()}
+
+    def _local_policy(self, policy):
+        # policy for the rollouts in the main process (num_cpu = 1)
+        if self.rollout_policy is self.policy:
+            return policy
+        self.rollout_policy.set_param_values(policy.get_param_values())
+        self.rollout_policy.set_transformations(*get_transformations(policy))
+        return self.rollout_policy
+
+    def restart(self):
+        self.stop()
+        return self.start()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # Sampling
+    # ============================================
+    def sample_paths(self, num_traj,
+                     policy=None,
+                     eval_mode=False,
+                     horizon=1e6,
+                     base_seed=None,
+                     suppress_print=False,
+                     env_info_keys=None,
+                     ):
+        """
+        Same as mjrl.samplers.core.sample_paths, but reuses the live workers.
+        :param policy:          policy with the parameters to use (defaults to the policy given at construction)
+        :param env_info_keys:   env_info keys to record (None records all, [] skips env_infos altogether)
+        """
+        self.start()
+        self._drain()
+        self.buffer_offsets = [0] * self.num_cpu
+        policy = self.policy if policy is None else policy
+
+        if self.num_cpu == 1:
+            return _rollout(self.local_envs, self._local_policy(policy),
+                            dict(num_traj=num_traj, eval_mode=eval_mode, horizon=horizon,
+                                 base_seed=base_seed, env_info_keys=env_info_keys))
+
+        paths_per_cpu = int(np.ceil(num_traj/self.num_cpu))
+        input_dict_list = []
+        for i in range(self.num_cpu):
+            input_dict = dict(num_traj=paths_per_cpu, eval_mode=eval_mode, horizon=horizon,
+                              base_seed=None if base_seed is None else base_seed + i * paths_per_cpu,
+                              env_info_keys=env_info_keys)
+            input_dict_list.append(input_dict)
+        if suppress_print is False:
+            start_time = timer.time()
+            print("####### Gathering Samples #######")
+
+        make_task = lambda j: input_dict_list[j] if j < len(input_dict_list) else None
+        results = dict()
+        self._dispatch(policy, make_task, lambda: len(results) == len(input_dict_list), results=results)
+        paths = []
+        for j in range(len(input_dict_list)):
+            for path in results[j]:
+                paths.append(path)
+
+        if suppress_print is False:
+            print("======= Samples Gathered  ======= | >>>> Time taken = %f " % (timer.time()-start_time))
+
+        return paths
+
+    def sample_data_batch(self, num_samples,
+                          policy=None,
+                          eval_mode=False,
+                          horizon=1e6,
+                          base_seed=None,
+                          paths_per_call=1,
+                          suppress_print=False,
+                          env_info_keys=None,
+                          ):
+        """
+        Same as mjrl.samplers.core.sample_data_batch, but trajectories are handed out to the workers
+        on demand (paths_per_call at a time) till num_samples have been collected.
+        Trajectory j is seeded with base_seed + j and the returned paths are the shortest prefix
+        (in j) with at least num_samples samples, so the result does not depend on num_cpu.
+        Overshoot, discarded samples and idle time per worker are stored in self.stats
+        """
+        self.start()
+        self._drain()
+        self.buffer_offsets = [0] * self.num_cpu
+        policy = self.policy if policy is None else policy
+        base_seed = 123 if base_seed is None else base_seed
+        start_time = timer.time()
+        if suppress_print is False:
+            print("####### Gathering Samples #######")
+
+        make_task = lambda j: dict(num_traj=paths_per_call, eval_mode=eval_mode, horizon=horizon,
+                                   base_seed=base_seed + j * paths_per_call, env_info_keys=env_info_keys)
+        num_prefix = lambda results: _num_prefix_tasks(results, num_samples)
+        if self.num_cpu == 1:
+            results, local_policy = dict(), self._local_policy(policy)
+            while num_prefix(results) is None:
+                j = len(results)
+                results[j] = _rollout(self.local_envs, local_policy, make_task(j))
+            busy_time = [timer.time() - start_time]
+        else:
+            # stop handing out work as soon as the finished trajectories have enough samples
+            results = dict()
+            should_dispatch = lambda: _num_samples(results.values()) < num_samples
+            busy_time = self._dispatch(policy, make_task,
+                                       lambda: num_prefix(results) is not None,
+                                       should_dispatch, results)
+
+        paths = []
+        for j in range(num_prefix(results)):
+            for path in results[j]:
+                paths.append(path)
+        sampled_so_far = _num_samples([paths])
+        total_time = timer.time() - start_time
+        self.stats = dict(num_samples=sampled_so_far,
+                          overshoot=sampled_so_far - num_samples,
+                          discarded_samples=_num_samples(results.values()) - sampled_so_far,
+                          idle_time=[max(total_time - t, 0.0) for t in busy_time])
+        if suppress_print is False:
+            print("======= Samples Gathered  ======= | >>>> Time taken = %f " % total_time)
+            print("................................. | >>>> # samples = %i # trajectories = %i " % (
+            sampled_so_far, len(paths)))
+            print("................................. | >>>> overshoot = %i discarded = %i max idle time = %f " % (
+            self.stats['overshoot'], self.stats['discarded_samples'], np.max(self.stats['idle_time'])))
+        return paths
+
+    def iter_paths(self, num_traj,
+                   policy=None,
+                   eval_mode=False,
+                   horizon=1e6,
+                   base_seed=None,
+                   env_info_keys=None,
+                   ordered=True,
+                   ):
+        """
+        Generator version of sample_paths: yields every path as soon as it is finished, so that the
+        paths can be processed (or written out) while the others are being collected.
+        Trajectory j is seeded with base_seed + j (same paths as sample_paths with the same base_seed).
+        :param ordered:     yield the paths in the order of j (else in the order they finish). Workers run
+                            at most 2 * num_cpu trajectories ahead of the next path to yield, which bounds
+                            the memory used for the paths that finish out of order.
+        With shm_capacity, the paths are views that are only valid till the next call on the pool.
+        """
+        self.start()
+        self._drain()
+        self.buffer_offsets = [0] * self.num_cpu
+        policy = self.policy if policy is None else policy
+
+        seed_of = lambda j: None if base_seed is None else base_seed + j
+        make_task = lambda j: dict(num_traj=1, eval_mode=eval_mode, horizon=horizon, base_seed=seed_of(j),
+                                   env_info_keys=env_info_keys) if j < num_traj else None
+        if self.num_cpu == 1:
+            local_policy = self._local_policy(policy)
+            for j in range(num_traj):
+                yield _rollout(self.local_envs, local_policy, make_task(j))[0]
+            return
+
+        results, num_made, num_yielded = dict(), [0], 0
+        def counted_make_task(j):
+            num_made[0] = j + 1
+            return make_task(j)
+        should_dispatch = (lambda: num_made[0] - num_yielded < 2 * self.num_cpu) if ordered else None
+        tasks = self._iter_dispatch(policy, counted_make_task, should_dispatch)
+        try:
+            for task_id, paths in tasks:
+                if not ordered:
+                    num_yielded += 1
+                    yield paths[0]
+                    continue
+                results[task_id] = paths
+                while num_yielded in results:
+                    num_yielded += 1
+                    yield results.pop(num_yielded - 1)[0]
+        finally:
+            tasks.close()
+
+    # Scheduling
+    # ============================================
+    def _dispatch(self, policy, make_task, is_done, should_dispatch=None, results=None):
+        """
+        Runs tasks (see _iter_dispatch) and stores their paths in results (dict of task_id -> paths)
+        till is_done() returns True or there are no tasks left.
+        :return:    the time each worker spent on rollouts
+        """
+        results = dict() if results is None else results
+        tasks = self._iter_dispatch(policy, make_task, should_dispatch)
+        try:
+            if not is_done():
+                for task_id, paths in tasks:
+                    results[task_id] = paths
+                    if is_done():
+                        break
+        finally:
+            tasks.close()
+        return self.busy_time
+
+    def _iter_dispatch(self, policy, make_task, should_dispatch=None):
+        """
+        Hands out tasks to the free workers (all with the same parameters) and yields (task_id, paths)
+        as the tasks finish. A task that fails (raises, crashes its worker, or runs longer than
+        max_process_time) is retried on its own, up to max_timeouts attempts, while the results of
+        all other tasks are kept. The time each worker spent on rollouts is kept in self.busy_time.
+        :param policy:          policy whose params and model transformations are broadcast to the workers once
+        :param make_task:       function task_id -> rollout kwargs (None when there are no tasks left)
+        :param should_dispatch: function () -> bool, False when no more tasks should be handed out (for now)
+        """
+        busy = dict()
+        tasks, attempts, retry_queue = dict(), dict(), []
+        self.busy_time = [0.0] * self.num_cpu
+        free = list(range(self.num_cpu))
+        next_task = 0
+        self.failures = []
+        # all the workers are idle here (see _drain), so the params can be overwritten
+        version = self.param_buffer.write(policy.get_param_values(), get_transformations(policy))
+
+        def handle_failure(worker, task_id, reason):
+            self.failures.append("task %i (worker %i, attempt %i): %s" % (task_id, worker, attempts[task_id], reason))
+            print("Sampler task %i failed on worker %i. %s" % (task_id, worker, reason.strip().split('\n')[-1]))
+            if attempts[task_id] >= self.max_timeouts:
+                raise RuntimeError("Sampler task %i failed %i times. Failures:\n%s" %
+                                   (task_id, attempts[task_id], '\n'.join(self.failures)))
+            retry_queue.append(task_id)
+
+        try:
+            while True:
+                while len(free) > 0 and (len(retry_queue) > 0 or should_dispatch is None or should_dispatch()):
+                    if len(retry_queue) > 0:
+                        task_id = retry_queue.pop(0)
+                    else:
+                        task = make_task(next_task)
+                        if task is None:
+                            break
+                        task_id, tasks[next_task] = next_task, task
+                        next_task += 1
+                    worker = free.pop(0)
+                    attempts[task_id] = attempts.get(task_id, 0) + 1
+                    self.conns[worker].send(('rollout', (version, tasks[task_id], self.buffer_offsets[worker])))
+                    busy[worker] = (task_id, timer.time())
+                if len(busy) == 0:
+                    return
+
+                # every worker gets max_process_time for its current task
+                deadline = min(t for _, t in busy.values()) + self.max_process_time
+                ready = mp.connection.wait([self.conns[w] for w in busy], timeout=max(deadline - timer.time(), 0))
+                finished = []
+                for conn in ready:
+                    worker = self.conns.index(conn)
+                    task_id, _ = busy.pop(worker)
+                    try:
+                        status, result, elapsed = conn.recv()
+                    except (EOFError, OSError):
+                        self.workers[worker].join(timeout=1)
+                        exitcode = self.workers[worker].exitcode
+                        self._restart_worker(worker)
+                        free.append(worker)
+                        handle_failure(worker, task_id, "Worker crashed (exitcode = %s)" % exitcode)
+                        continue
+                    free.append(worker)
+                    if status != 'ok':
+                        handle_failure(worker, task_id, result)
+                        continue
+                    self.busy_time[worker] += elapsed
+                    if self.path_buffers is not None:
+                        self.buffer_offsets[worker] = result['end']
+                        result = self.path_buffers[worker].read(result)
+                    finished.append((task_id, result))
+                for worker, (task_id, t) in list(busy.items()):
+                    if timer.time() - t > self.max_process_time:
+                        busy.pop(worker)
+                        self._restart_worker(worker)
+                        free.append(worker)
+                        handle_failure(worker, task_id, "Timed out after %i seconds" % self.max_process_time)
+                for task_id, result in finished:
+                    yield task_id, result
+        finally:
+            # workers still busy with tasks that are no longer needed, collected in _drain
+            self.outstanding = list(busy.keys())
+
+    def _drain(self):
+        # wait for (and discard) the results of tasks from the previous call
+        for worker in self.outstanding:
+            try:
+                if self.conns[worker].poll(self.max_process_time):
+                    self.conns[worker].recv()
+                    continue
+            except (EOFError, OSError):
+                pass
+            self._restart_worker(worker)
+        self.outstanding = []
+
+
+def _num_samples(results):
+    return int(np.sum([len(path['rewards']) for paths in results for path in paths]))
+
+
+def _num_prefix_tasks(results, num_samples):
+    # smallest k such that tasks 0 .. k-1 are finished and have num_samples samples (None if no such k)
+    total, k = 0, 0
+    while k in results:
+        total += _num_samples([results[k]])
+        k += 1
+        if total >= num_samples:
+            return k
+    return None
@@ -1,22 +1,56 @@
 import numpy as np
 
-def cg_solve(f_Ax, b, x_0=None, cg_iters=10, residual_tol=1e-10):
-    x = np.zeros_like(b) #if x_0 is None else x_0
-    r = b.copy() #if x_0 is None else b-f_Ax(x_0)
-    p = r.copy()
+def cg_solve(f_Ax, b, x_0=None, cg_iters=10, residual_tol=1e-10,
+             M_inv=None, rel_tol=None, stats=None):
+    """
+    (Preconditioned) conjugate gradient for A x = b
+    :param f_Ax:            function computing the product A v
+    :param b:               right hand side
+    :param x_0:             initial guess (warm start). It is rescaled to the best multiple along it
+                            (in the A norm), which costs one extra product.
+    :param cg_iters:        max number of iterations (products)
+    :param residual_tol:    stop when the squared norm of the residual is below this
+    :param M_inv:           diagonal of the inverse preconditioner (e.g. 1/diag(A)), or None
+    :param rel_tol:         stop when norm(residual) <= rel_tol * norm(b) (if not None)
+    :param stats:           optional dict, filled with 'iters' (CG iterations), 'products' (products
+                            with A) and 'residual' (norm(residual) / norm(b))
+    """
+    b_norm = np.linalg.norm(b) + 1e-20
+    products = 0
+    if x_0 is None:
+        x = np.zeros_like(b)
+        r = b.copy()
+    else:
+        z = f_Ax(x_0)
+        products += 1
+        zdotx = x_0.dot(z)
+        scale = x_0.dot(b) / zdotx if zdotx > 0 else 0.0
+        x = scale * x_0
+        r = b - scale * z
+    z = r if M_inv is None else M_inv * r
+    p = z.copy()
+    rdotz = r.dot(z)
     rdotr = r.dot(r)
 
-    for i in range(cg_iters):
-        z = f_Ax(p)
-        v = rdotr / p.dot(z)
+    i = 0
+    while i < cg_iters and rdotr >= residual_tol and \
+            (rel_tol is None or np.sqrt(rdotr) > rel_tol * b_norm):
+        Ap = f_Ax(p)
+        products += 1
+        v = rdotz / p.dot(Ap)
         x += v * p
-        r -= v * z
-        newrdotr = r.dot(r)
-        mu = newrdotr / rdotr
-        p = r + mu * p
+        r -= v * Ap
+        z = r if M_inv is None else M_inv * r
+        newrdotz = r.dot(z)
+        mu = newrdotz / rdotz
+        p = z + mu * p
 
-        rdotr = newrdotr
-        if rdotr < residual_tol:
-            break
+        rdotz = newrdotz
+        rdotr = r.dot(r)
+        i += 1
 
+    if stats is not None:
+        stats['iters'] = i
+        stats['products'] = products
+        stats['residual'] = np.sqrt(rdotr) / b_norm
     return x
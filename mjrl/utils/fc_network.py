@@ -50,3 +50,9 @@ class FCNetwork(nn.Module):
         out = self.fc_layers[-1](out)
         out = out * self.out_scale + self.out_shift
         return out
+
+
+def inference_mode():
+    # context for forward passes that are not differentiated (no autograd graph is built)
+    # torch.inference_mode is only available in newer versions of torch
+    return torch.inference_mode() if hasattr(torch, 'inference_mode') else torch.no_grad()
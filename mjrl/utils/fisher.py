@@ -0,0 +1,185 @@
+"""
+Fisher information matrix of the diagonal Gaussian policies (MLP and LinearPolicy).
+For a policy N(mu(s), diag(sigma^2)) with mean network params theta and log_std params,
+the Fisher (= Hessian of the mean KL at old = new) has the closed form
+
+    F = [ 1/N sum_s J(s)^T diag(1/sigma^2) J(s)    0  ]
+        [ 0                                         2I ]
+
+where J(s) is the Jacobian of mu(s) wrt theta. A product F v hence only needs a
+Jacobian-vector product and a vector-Jacobian product through the network, which
+are computed here from the activations of a single forward pass (no double backprop).
+For small policies the matrix itself can be built from per-sample Jacobians (see matrix).
+"""
+
+import numpy as np
+import torch
+from mjrl.utils.fc_network import FCNetwork
+
+
+class GaussianFisher:
+    def __init__(self, policy, observations):
+        """
+        :param policy:          MLP or LinearPolicy (see gaussian_mlp.py and gaussian_linear.py)
+        :param observations:    observations (N, n) over which the Fisher is averaged
+        The Fisher is evaluated at the current parameters of the policy (which is where the
+        Hessian of the KL is evaluated during the NPG update, since old = new).
+        """
+        if not isinstance(getattr(policy, 'model', None), FCNetwork) or not hasattr(policy, 'log_std'):
+            print("The analytic Fisher is only available for Gaussian policies with an FCNetwork mean (MLP, LinearPolicy)")
+            raise AttributeError
+        model = policy.model
+        self.weights = [layer.weight.data for layer in model.fc_layers]
+        self.out_scale = model.out_scale
+        self.param_sizes = [int(np.prod(p.shape)) for p in policy.trainable_params]
+        self.num_log_std = self.param_sizes[-1]
+        self.inv_var = torch.exp(-2.0 * policy.log_std.data)
+        self.relu = model.nonlinearity is torch.relu
+        self.is_linear = len(self.weights) == 1
+
+        # forward pass: inputs of every layer and derivatives of the nonlinearities
+        self.layer_inputs, self.activation_grads = [], []
+        with torch.no_grad():
+            obs = observations if type(observations) is torch.Tensor else torch.from_numpy(np.float32(observations))
+            out = (obs - model.in_shift) / (model.in_scale + 1e-8)
+            for i, layer in enumerate(model.fc_layers):
+                self.layer_inputs.append(out)
+                out = layer(out)
+                if i < len(model.fc_layers) - 1:
+                    out = model.nonlinearity(out)
+                    self.activation_grads.append((out > 0).float() if self.relu else 1.0 - out ** 2)
+        self.num_samples = observations.shape[0]
+
+    def _split(self, vector):
+        # views of the flat vector in the layout of the trainable params (W0, b0, W1, b1, ..., log_std)
+        vecs, idx = [], 0
+        for size, W in zip(self.param_sizes[:-1:2], self.weights):
+            vecs.append((vector[idx:idx+size].view(W.shape), vector[idx+size:idx+size+W.shape[0]]))
+            idx += size + W.shape[0]
+        return vecs, vector[idx:]
+
+    def _jvp(self, layer_vecs, idx):
+        # Jacobian of the mean (for the samples idx) times the param direction
+        dz = None
+        for i, (dW, db) in enumerate(layer_vecs):
+            h = self.layer_inputs[i] if idx is None else self.layer_inputs[i][idx]
+            dz_i = h.matmul(dW.t()) + db
+            if dz is not None:
+                dz_i += dz.matmul(self.weights[i].t())
+            if i < len(layer_vecs) - 1:
+                grad = self.activation_grads[i] if idx is None else self.activation_grads[i][idx]
+                dz = grad * dz_i
+            else:
+                dz = dz_i
+        return dz * self.out_scale
+
+    def _vjp(self, g, idx):
+        # vector (per sample output gradients) times the Jacobian of the mean
+        g = g * self.out_scale
+        grads = []
+        for i in reversed(range(len(self.weights))):
+            h = self.layer_inputs[i] if idx is None else self.layer_inputs[i][idx]
+            grads = [g.t().matmul(h).reshape(-1), g.sum(0)] + grads
+            if i > 0:
+                grad = self.activation_grads[i-1] if idx is None else self.activation_grads[i-1][idx]
+                g = g.matmul(self.weights[i]) * grad
+        return grads
+
+    def fvp(self, vector, idx=None):
+        """
+        :param vector:  flat numpy vector (in the layout of policy.get_param_values())
+        :param idx:     optional indices of the samples to average the Fisher over (default: all)
+        :return:        Fisher vector product (numpy)
+        """
+        with torch.no_grad():
+            vec = torch.from_numpy(np.float32(vector))
+            layer_vecs, log_std_vec = self._split(vec)
+            num_samples = self.num_samples if idx is None else len(idx)
+            Jv = self._jvp(layer_vecs, idx)
+            grads = self._vjp(Jv * self.inv_var / num_samples, idx)
+            fvp = torch.cat(grads + [2.0 * log_std_vec])
+        return fvp.numpy()
+
+    def quadratic_form(self, vector, idx=None):
+        """
+        :return:    v^T F v (only needs the Jacobian-vector product)
+        """
+        with torch.no_grad():
+            vec = torch.from_numpy(np.float32(vector))
+            layer_vecs, log_std_vec = self._split(vec)
+            Jv = self._jvp(layer_vecs, idx)
+            quad = torch.mean(torch.sum(Jv ** 2 * self.inv_var, dim=1)) + 2.0 * torch.sum(log_std_vec ** 2)
+        return quad.item()
+
+    def diagonal(self, idx=None):
+        """
+        :param idx:     optional indices of the samples to average the Fisher over (default: all)
+        :return:        diagonal of the Fisher (numpy), e.g. for a Jacobi preconditioner
+        """
+        idx = np.arange(self.num_samples) if idx is None else np.asarray(idx)
+        m = self.num_log_std
+        diag = []
+        with torch.no_grad():
+            # per-sample gradients of every output of the mean (backprop of the identity)
+            g = torch.diag(self.out_scale).expand(len(idx), m, m)
+            for i in reversed(range(len(self.weights))):
+                h = self.layer_inputs[i][idx]
+                # sum over the outputs of the squared Jacobian entries (weighted by 1/sigma^2)
+                g2 = (g ** 2 * self.inv_var[None, :, None]).sum(1)
+                diag = [g2.t().matmul(h ** 2).reshape(-1) / len(idx), g2.mean(0)] + diag
+                if i > 0:
+                    g = g.matmul(self.weights[i]) * self.activation_grads[i-1][idx][:, None, :]
+            diag.append(2.0 * torch.ones(m))
+        return torch.cat(diag).double().numpy()
+
+    def _jacobians(self, idx):
+        # per-sample Jacobians of the mean wrt the network params, shape (B, m, d - m)
+        m = self.weights[-1].shape[0]
+        g = torch.diag(self.out_scale).expand(len(idx), m, m)
+        jacobians = []
+        for i in reversed(range(len(self.weights))):
+            h = self.layer_inputs[i][idx]
+            jacobians = [(g[:, :, :, None] * h[:, None, None, :]).reshape(len(idx), m, -1), g] + jacobians
+            if i > 0:
+                g = g.matmul(self.weights[i]) * self.activation_grads[i-1][idx][:, None, :]
+        return torch.cat(jacobians, dim=2)
+
+    def matrix(self, idx=None, max_chunk_elements=2**22):
+        """
+        :param idx:                 optional indices of the samples to average the Fisher over (default: all)
+        :param max_chunk_elements:  the Jacobians are built for chunks of samples of at most this many elements
+        :return:                    Fisher matrix (d, d) as float64 numpy array
+        Costs O(N m d^2) for MLPs (only worth it for very small ones or subsampled Fisher),
+        and O(N n^2 + d^2) for linear policies (see _linear_matrix).
+        """
+        idx = np.arange(self.num_samples) if idx is None else np.asarray(idx)
+        if self.is_linear:
+            return self._linear_matrix(idx)
+        d_net = sum(self.param_sizes[:-1])
+        m = self.num_log_std
+        chunk_size = max(1, max_chunk_elements // (m * d_net))
+        F = torch.zeros(d_net + m, d_net + m, dtype=torch.float64)
+        # scale the Jacobian rows by 1/sigma, so that J^T diag(1/sigma^2) J = J^T J
+        inv_std = torch.sqrt(self.inv_var)[None, :, None]
+        with torch.no_grad():
+            for start in range(0, len(idx), chunk_size):
+                J = (self._jacobians(idx[start:start+chunk_size]) * inv_std).reshape(-1, d_net).double()
+                F[:d_net, :d_net] += J.t().matmul(J)
+            F[:d_net, :d_net] /= len(idx)
+            F[d_net:, d_net:] = 2.0 * torch.eye(m, dtype=torch.float64)
+        return F.numpy()
+
+    def _linear_matrix(self, idx):
+        # mu_k = out_scale_k (W_k x + b_k), so the block of (W_k, b_k) is out_scale_k^2 / sigma_k^2 E[[x, 1] [x, 1]^T]
+        # and the blocks of different outputs are zero
+        m, n = self.weights[0].shape
+        x = self.layer_inputs[0][idx].double().numpy()
+        x1 = np.concatenate([x, np.ones((len(idx), 1))], axis=1)
+        G = x1.T.dot(x1) / len(idx)
+        coefs = np.float64(self.out_scale.numpy()) ** 2 * np.float64(self.inv_var.numpy())
+        F = np.zeros((m * n + 2 * m, m * n + 2 * m))
+        for k in range(m):
+            k_idx = np.concatenate([np.arange(k * n, (k + 1) * n), [m * n + k]])
+            F[np.ix_(k_idx, k_idx)] = coefs[k] * G
+        F[m * n + m:, m * n + m:] = 2.0 * np.eye(m)
+        return F
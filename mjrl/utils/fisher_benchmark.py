@@ -0,0 +1,104 @@
+"""
+Benchmark of the Fisher vector products used by the NPG update.
+Times the CG solve of the NPG direction (as in NPG.train_from_paths) with the double
+backprop HVP and with the analytic Fisher of utils/fisher.py, across policy sizes and
+batch sizes, and reports the speedup and the relative difference of the directions.
+
+USAGE:\n
+    $ python -m mjrl.utils.fisher_benchmark --hidden_sizes 32-32,64-64 --num_samples 5000,20000 --output results.json\n
+"""
+
+import logging
+logging.disable(logging.CRITICAL)
+import json
+import time as timer
+import click
+import numpy as np
+from tabulate import tabulate
+from mjrl.utils.gym_env import EnvSpec
+from mjrl.utils.cg_solve import cg_solve
+from mjrl.policies.gaussian_mlp import MLP
+from mjrl.algos.npg_cg import NPG
+
+
+def _best_time(func, repeats):
+    best, out = np.inf, None
+    for _ in range(repeats):
+        t0 = timer.time()
+        out = func()
+        best = min(best, timer.time() - t0)
+    return best, out
+
+
+def run_benchmark(hidden_sizes_list=((32, 32), (64, 64)),
+                  num_samples_list=(5000, 20000),
+                  obs_dim=20, act_dim=6,
+                  cg_iters=10,
+                  repeats=3,
+                  seed=123):
+    """
+    :param hidden_sizes_list:   list of policy hidden sizes
+    :param num_samples_list:    list of batch sizes (samples the Fisher is averaged over)
+    :param obs_dim:             observation dimension (random observations and actions are used)
+    :param act_dim:             action dimension
+    :param cg_iters:            CG iterations (as in FIM_invert_args)
+    :param repeats:             repeats per measurement (best is reported)
+    :return:                    list of result dicts
+    """
+    spec = EnvSpec(obs_dim, act_dim, horizon=100)
+    results = []
+    for hidden_sizes in hidden_sizes_list:
+        policy = MLP(spec, hidden_sizes=tuple(hidden_sizes), seed=seed)
+        rng = np.random.RandomState(seed)
+        policy.set_param_values(policy.get_param_values() + 0.1 * rng.randn(policy.d))
+        for num_samples in num_samples_list:
+            observations = rng.randn(num_samples, obs_dim)
+            actions = rng.randn(num_samples, act_dim)
+            grad = rng.randn(policy.d)
+            times, directions = dict(), dict()
+            for fvp_type in ['hvp', 'analytic']:
+                agent = NPG(None, policy, None, FIM_invert_args={'iters': cg_iters, 'damping': 1e-4, 'fvp': fvp_type})
+                solve = lambda: cg_solve(agent.build_Hvp_eval([observations, actions]), grad, cg_iters=cg_iters)
+                times[fvp_type], directions[fvp_type] = _best_time(solve, repeats)
+            results.append(dict(hidden_sizes=list(hidden_sizes), num_samples=num_samples, num_params=int(policy.d),
+                                hvp_time=times['hvp'], analytic_time=times['analytic'],
+                                speedup=times['hvp'] / times['analytic'],
+                                rel_diff=float(np.linalg.norm(directions['hvp'] - directions['analytic']) /
+                                               np.linalg.norm(directions['hvp']))))
+    return results
+
+
+def print_results(results):
+    print(tabulate([['-'.join(str(h) for h in r['hidden_sizes']), r['num_params'], r['num_samples'],
+                     '%.1f' % (1e3 * r['hvp_time']), '%.1f' % (1e3 * r['analytic_time']),
+                     '%.2fx' % r['speedup'], '%.1e' % r['rel_diff']] for r in results],
+                   headers=['hidden', 'params', 'samples', 'hvp (ms)', 'analytic (ms)', 'speedup', 'rel. diff']))
+
+
+def _parse_list(value, sep=','):
+    return [int(v) for v in value.split(sep)]
+
+
+DESC = __doc__
+
+
+@click.command(help=DESC)
+@click.option('--hidden_sizes', type=str, help='comma separated list of policy sizes (e.g. 32-32,64-64)', default='32-32,64-64')
+@click.option('--num_samples', type=str, help='comma separated list of batch sizes', default='5000,20000')
+@click.option('--obs_dim', type=int, help='observation dimension', default=20)
+@click.option('--act_dim', type=int, help='action dimension', default=6)
+@click.option('--cg_iters', type=int, help='CG iterations', default=10)
+@click.option('--repeats', type=int, help='repeats per measurement (best is reported)', default=3)
+@click.option('--output', type=str, help='json file to write the results to', default=None)
+def main(hidden_sizes, num_samples, obs_dim, act_dim, cg_iters, repeats, output):
+    results = run_benchmark(hidden_sizes_list=[_parse_list(h, '-') for h in hidden_sizes.split(',')],
+                            num_samples_list=_parse_list(num_samples), obs_dim=obs_dim, act_dim=act_dim,
+                            cg_iters=cg_iters, repeats=repeats)
+    print_results(results)
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
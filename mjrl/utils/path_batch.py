@@ -0,0 +1,161 @@
+"""
+Columnar storage for a batch of paths.
+All per-timestep arrays of the paths are concatenated once into contiguous
+columns, and the paths are exposed as views into these columns.
+"""
+
+import numpy as np
+from collections.abc import MutableMapping
+from mjrl.utils import tensor_utils
+
+
+class PathBatch:
+    def __init__(self, paths):
+        """
+        :param paths:   list of paths (dicts with per-timestep arrays like observations, actions, rewards).
+                        Only observations are required (e.g. demo paths without rewards).
+        PathBatch behaves like the list of paths (len, iteration and indexing give per-path views which
+        can also be written to), while full columns are available without copies via get(key).
+        Per-path values that are not per-timestep arrays (e.g. terminated) are stored per path.
+        """
+        if isinstance(paths, PathBatch):
+            paths = list(paths)
+        self.lengths = np.array([len(path['observations']) for path in paths], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(self.lengths)]).astype(np.int64)
+        self.num_samples = int(self.offsets[-1])
+        self.columns = dict()
+        self.extras = [dict() for _ in paths]
+        for k in paths[0].keys():
+            values = [path[k] for path in paths]
+            column = self._concat(values)
+            if column is not None:
+                self.columns[k] = column
+            else:
+                for i, v in enumerate(values):
+                    self.extras[i][k] = v
+
+    def _is_column(self, values):
+        # per-timestep arrays have one entry per sample in every path
+        if isinstance(values[0], dict):
+            return all(isinstance(v, dict) and v.keys() == values[0].keys() for v in values) and \
+                   all(self._is_column([v[k] for v in values]) for k in values[0].keys())
+        return all(isinstance(v, np.ndarray) and v.ndim > 0 and v.shape[0] == l
+                   for v, l in zip(values, self.lengths))
+
+    def _concat(self, values):
+        if not self._is_column(values):
+            return None
+        if isinstance(values[0], dict):
+            return tensor_utils.concat_tensor_dict_list(values)
+        return np.concatenate(values)
+
+    def _slice(self, column, start, end):
+        if isinstance(column, dict):
+            return {k: self._slice(v, start, end) for k, v in column.items()}
+        return column[start:end]
+
+    # List of paths behavior
+    # ============================================
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, idx):
+        return PathView(self, idx)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield PathView(self, idx)
+
+    # Columns
+    # ============================================
+    def get(self, key):
+        # concatenated column for all the paths (no copy)
+        return self.columns[key]
+
+    def get_path_value(self, idx, key):
+        if key in self.columns:
+            return self._slice(self.columns[key], self.offsets[idx], self.offsets[idx+1])
+        return self.extras[idx][key]
+
+    def set_path_value(self, idx, key, value):
+        start, end = self.offsets[idx], self.offsets[idx+1]
+        if isinstance(value, np.ndarray) and value.ndim > 0 and value.shape[0] == end - start:
+            if key not in self.columns and all(key not in extra for extra in self.extras):
+                self.columns[key] = np.zeros((self.num_samples,) + value.shape[1:], dtype=value.dtype)
+            if key in self.columns:
+                self.columns[key][start:end] = value
+                return
+        if key in self.columns:
+            # can't write a per-path value into the column any longer
+            for i in range(len(self)):
+                self.extras[i][key] = self.get_path_value(i, key)
+            del self.columns[key]
+        self.extras[idx][key] = value
+
+    def path_keys(self, idx):
+        return list(self.columns.keys()) + list(self.extras[idx].keys())
+
+
+class PathView(MutableMapping):
+    """ Single path of a PathBatch. Reads and writes go to the columns of the batch. """
+    def __init__(self, batch, idx):
+        self.batch = batch
+        self.idx = idx
+
+    def __getitem__(self, key):
+        try:
+            return self.batch.get_path_value(self.idx, key)
+        except KeyError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self.batch.set_path_value(self.idx, key, value)
+
+    def __delitem__(self, key):
+        del self.batch.extras[self.idx][key]
+
+    def __iter__(self):
+        return iter(self.batch.path_keys(self.idx))
+
+    def __len__(self):
+        return len(self.batch.path_keys(self.idx))
+
+
+# Utility functions that work with both PathBatch and list of paths
+# =======================================================
+def concat(paths, key):
+    if isinstance(paths, PathBatch) and key in paths.columns:
+        return paths.get(key)
+    return np.concatenate([path[key] for path in paths])
+
+
+def path_lengths(paths):
+    if isinstance(paths, PathBatch):
+        return paths.lengths
+    return np.array([len(path["observations"]) for path in paths], dtype=np.int64)
+
+
+def time_steps(paths):
+    # time index (within its path) of every sample
+    lengths = path_lengths(paths)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    return np.arange(np.sum(lengths)) - np.repeat(starts, lengths)
+
+
+def path_returns(paths):
+    # undiscounted return of every path
+    if isinstance(paths, PathBatch):
+        return np.add.reduceat(paths.get("rewards"), paths.offsets[:-1])
+    return np.array([np.sum(path["rewards"]) for path in paths])
+
+
+def stratified_sample_idx(lengths, frac):
+    # indices of a random fraction (at least one sample) of the samples of every path, without replacement
+    lengths = np.asarray(lengths)
+    path_idx = np.repeat(np.arange(len(lengths)), lengths)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    # random permutation within every path
+    order = np.lexsort((np.random.rand(len(path_idx)), path_idx))
+    rank = np.arange(len(path_idx)) - np.repeat(starts, lengths)
+    num_per_path = np.maximum(1, np.round(frac * lengths)).astype(np.int64)
+    return np.sort(order[rank < np.repeat(num_per_path, lengths)])
@@ -1,4 +1,5 @@
 import numpy as np
+from mjrl.utils import path_batch
 
 def compute_returns(paths, gamma):
     for path in paths:
@@ -12,7 +13,7 @@ def compute_advantages(paths, baseline, gamma, gae_lambda=None, normalize=False)
             path["baseline"] = baseline.predict(path)
             path["advantages"] = path["returns"] - path["baseline"]
         if normalize:
-            alladv = np.concatenate([path["advantages"] for path in paths])
+            alladv = path_batch.concat(paths, "advantages")
             mean_adv = alladv.mean()
             std_adv = alladv.std()
             for path in paths:
@@ -28,7 +29,7 @@ def compute_advantages(paths, baseline, gamma, gae_lambda=None, normalize=False)
             td_deltas = path["rewards"] + gamma*b1[1:] - b1[:-1]
             path["advantages"] = discount_sum(td_deltas, gamma*gae_lambda)
         if normalize:
-            alladv = np.concatenate([path["advantages"] for path in paths])
+            alladv = path_batch.concat(paths, "advantages")
             mean_adv = alladv.mean()
             std_adv = alladv.std()
             for path in paths:
@@ -5,6 +5,8 @@ from tabulate import tabulate
 from mjrl.utils.make_train_plots import make_train_plots
 from mjrl.utils.gym_env import GymEnv
 from mjrl.samplers.core import sample_paths
+from mjrl.samplers.worker_pool import SamplerPool
+from mjrl.samplers.async_sampler import AsyncSampler
 import numpy as np
 import pickle
 import time as timer
@@ -71,6 +73,10 @@ def train_agent(job_name, agent,
                 save_freq = 10,
                 evaluation_rollouts = None,
                 plot_keys = ['stoc_pol_mean'],
+                persistent_sampler = False,
+                async_sampling = False,
+                max_policy_lag = 1,
+                env_info_keys = None,
                 ):
 
     np.random.seed(seed)
@@ -94,6 +100,12 @@ def train_agent(job_name, agent,
     if i_start:
         print("Resuming from an existing job folder ...")
 
+    # keep the rollout workers (and their envs) alive across iterations
+    sampler = SamplerPool(agent.env.env_id, agent.policy, num_cpu=num_cpu).start() \
+              if persistent_sampler or async_sampling else None
+    # collect the next batch (with a policy up to max_policy_lag updates old) during the update
+    sampler = AsyncSampler(sampler, max_policy_lag=max_policy_lag) if async_sampling else sampler
+
     for i in range(i_start, niter):
         print("......................................................................................")
         print("ITERATION : %i " % i)
@@ -104,13 +116,19 @@ def train_agent(job_name, agent,
 
         N = num_traj if sample_mode == 'trajectories' else num_samples
         args = dict(N=N, sample_mode=sample_mode, gamma=gamma, gae_lambda=gae_lambda, num_cpu=num_cpu)
+        if sampler is not None: args['sampler'] = sampler
+        if env_info_keys is not None: args['env_info_keys'] = env_info_keys
         stats = agent.train_step(**args)
         train_curve[i] = stats[0]
 
         if evaluation_rollouts is not None and evaluation_rollouts > 0:
             print("Performing evaluation rollouts ........")
-            eval_paths = sample_paths(num_traj=evaluation_rollouts, policy=agent.policy, num_cpu=num_cpu,
-                                      env=e.env_id, eval_mode=True, base_seed=seed)
+            if isinstance(sampler, SamplerPool):
+                eval_paths = sampler.sample_paths(evaluation_rollouts, policy=agent.policy,
+                                                  eval_mode=True, base_seed=seed)
+            else:
+                eval_paths = sample_paths(num_traj=evaluation_rollouts, policy=agent.policy, num_cpu=num_cpu,
+                                          env=e.env_id, eval_mode=True, base_seed=seed)
             mean_pol_perf = np.mean([np.sum(path['rewards']) for path in eval_paths])
             if agent.save_logs:
                 agent.logger.log_kv('eval_score', mean_pol_perf)
@@ -142,6 +160,8 @@ def train_agent(job_name, agent,
                                        agent.logger.get_current_log().items()))
             print(tabulate(print_data))
 
+    if sampler is not None: sampler.stop()
+
     # final save
     pickle.dump(best_policy, open('iterations/best_policy.pickle', 'wb'))
     if agent.save_logs:
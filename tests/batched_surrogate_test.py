@@ -0,0 +1,40 @@
+from mjrl.utils.gym_env import EnvSpec
+from mjrl.policies.gaussian_mlp import MLP
+from mjrl.policies.gaussian_linear import LinearPolicy
+from mjrl.algos.batch_reinforce import BatchREINFORCE
+import numpy as np
+import torch
+SEED = 500
+
+spec = EnvSpec(obs_dim=8, act_dim=3, horizon=100)
+np.random.seed(SEED)
+observations = np.random.randn(500, spec.observation_dim)
+actions = np.random.randn(500, spec.action_dim)
+advantages = np.random.randn(500)
+
+relu_policy = MLP(spec, hidden_sizes=(32,32), seed=SEED, init_log_std=-0.5)
+relu_policy.model.nonlinearity = relu_policy.old_model.nonlinearity = torch.relu
+for policy in [MLP(spec, hidden_sizes=(32,32), seed=SEED, init_log_std=-0.5),
+               relu_policy,
+               LinearPolicy(spec, seed=SEED, init_log_std=-0.5)]:
+    # input normalization and a move away from the initialization, old = new
+    policy.model.set_transformations(in_shift=np.random.randn(spec.observation_dim),
+                                     in_scale=1.0 + np.random.rand(spec.observation_dim))
+    params = policy.get_param_values()
+    policy.set_param_values(params + 0.1 * np.random.randn(params.shape[0]))
+    agent = BatchREINFORCE(None, policy, None, seed=SEED)
+    curr_params = policy.get_param_values()
+    # candidates along a direction, and one with log_std below min_log_std (clamped)
+    direction = np.random.randn(policy.d)
+    candidates = np.stack([curr_params + alpha * direction for alpha in [0.0, 0.01, 0.1, 0.5]] +
+                          [np.concatenate([curr_params[:-spec.action_dim], -10.0 * np.ones(spec.action_dim)])])
+    surr, kl = agent.batched_surrogate_kl(observations, actions, advantages, candidates)
+    for k in range(candidates.shape[0]):
+        policy.set_param_values(candidates[k], set_new=True, set_old=False)
+        with torch.no_grad():
+            surr_k = agent.CPI_surrogate(observations, actions, advantages).item()
+            kl_k = agent.kl_old_new(observations, actions).item()
+        assert np.allclose(surr[k], surr_k, rtol=1e-4, atol=1e-5)
+        assert np.allclose(kl[k], kl_k, rtol=1e-4, atol=1e-5)
+    policy.set_param_values(curr_params)
+print("Batched surrogate and KL match CPI_surrogate and kl_old_new")
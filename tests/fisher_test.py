@@ -0,0 +1,40 @@
+from mjrl.utils.gym_env import EnvSpec
+from mjrl.policies.gaussian_mlp import MLP
+from mjrl.policies.gaussian_linear import LinearPolicy
+from mjrl.algos.npg_cg import NPG
+from mjrl.utils.fisher import GaussianFisher
+from mjrl.utils.cg_solve import cg_solve
+import numpy as np
+import torch
+SEED = 500
+
+spec = EnvSpec(obs_dim=8, act_dim=3, horizon=100)
+np.random.seed(SEED)
+observations = np.random.randn(500, spec.observation_dim)
+actions = np.random.randn(500, spec.action_dim)
+
+relu_policy = MLP(spec, hidden_sizes=(32,32), seed=SEED, init_log_std=-0.5)
+relu_policy.model.nonlinearity = relu_policy.old_model.nonlinearity = torch.relu
+for policy in [MLP(spec, hidden_sizes=(32,32), seed=SEED, init_log_std=-0.5),
+               relu_policy,
+               LinearPolicy(spec, seed=SEED, init_log_std=-0.5)]:
+    # move away from the initialization (small last layer), old = new as during the update
+    params = policy.get_param_values()
+    policy.set_param_values(params + 0.1 * np.random.randn(params.shape[0]))
+    agent = NPG(None, policy, None, seed=SEED)
+    fisher = GaussianFisher(policy, observations)
+    for _ in range(3):
+        vector = np.random.randn(policy.d)
+        hvp = agent.HVP(observations, actions, vector, regu_coef=0.0)
+        fvp = fisher.fvp(vector)
+        assert np.allclose(hvp, fvp, rtol=1e-3, atol=1e-4 * np.abs(hvp).max())
+        # explicit Fisher matrix (used by the cholesky solver)
+        assert np.allclose(fisher.matrix().dot(vector), fvp, rtol=1e-3, atol=1e-4 * np.abs(hvp).max())
+    # NPG direction with both products
+    grad = np.random.randn(policy.d)
+    directions = []
+    for fvp_type in ['hvp', 'analytic']:
+        agent = NPG(None, policy, None, FIM_invert_args={'iters': 10, 'damping': 1e-4, 'fvp': fvp_type})
+        directions.append(cg_solve(agent.build_Hvp_eval([observations, actions]), grad, cg_iters=10))
+    assert np.allclose(directions[0], directions[1], rtol=1e-2, atol=1e-3 * np.abs(directions[0]).max())
+print("Analytic Fisher vector product and Fisher matrix match HVP")
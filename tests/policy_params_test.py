@@ -0,0 +1,22 @@
+from mjrl.utils.gym_env import EnvSpec
+from mjrl.policies.gaussian_mlp import MLP
+from mjrl.policies.gaussian_linear import LinearPolicy
+import numpy as np
+import torch
+SEED = 500
+
+spec = EnvSpec(obs_dim=8, act_dim=3, horizon=100)
+for policy in [MLP(spec, hidden_sizes=(32,32), seed=SEED), LinearPolicy(spec, seed=SEED)]:
+    # get_param_values returns float32, which torch.from_numpy does not copy: the new and
+    # old params must still end up in separate storage (else the old policy tracks the new one)
+    policy.set_param_values(policy.get_param_values())
+    for new, old in zip(policy.trainable_params, policy.old_params):
+        assert new.data.data_ptr() != old.data.data_ptr()
+    old_values = [p.data.clone() for p in policy.old_params]
+    with torch.no_grad():
+        for p in policy.trainable_params:
+            p.add_(1.0)
+    for p, values in zip(policy.old_params, old_values):
+        assert torch.equal(p.data, values)
+    assert not np.allclose(policy.get_param_values(), np.concatenate([v.numpy().ravel() for v in old_values]))
+print("New and old policy params do not share storage")
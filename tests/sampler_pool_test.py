@@ -0,0 +1,54 @@
+from mjrl.utils.gym_env import GymEnv
+from mjrl.policies.gaussian_mlp import MLP
+from mjrl.samplers.core import sample_paths, sample_data_batch
+from mjrl.samplers.worker_pool import SamplerPool
+import mjrl.envs
+import numpy as np
+SEED = 500
+
+e = GymEnv('mjrl_point_mass-v0')
+policy = MLP(e.spec, hidden_sizes=(32,32), seed=SEED)
+
+with SamplerPool('mjrl_point_mass-v0', policy, num_cpu=2) as sampler:
+    for itr in range(3):
+        pool_paths = sampler.sample_paths(10, base_seed=SEED)
+        ref_paths = sample_paths(10, 'mjrl_point_mass-v0', policy, base_seed=SEED, num_cpu=2)
+        assert len(pool_paths) == len(ref_paths)
+        for p1, p2 in zip(pool_paths, ref_paths):
+            assert np.allclose(p1['actions'], p2['actions'])
+        # workers should pick up the new parameters
+        policy.set_param_values(policy.get_param_values() + 0.01)
+print("Persistent sampler matches sample_paths")
+
+# workers should pick up changes of the input normalization (e.g. NPG input_normalization) too
+with SamplerPool('mjrl_point_mass-v0', policy, num_cpu=2) as sampler:
+    for itr in range(3):
+        pool_paths = sampler.sample_paths(10, base_seed=SEED)
+        ref_paths = sample_paths(10, 'mjrl_point_mass-v0', policy, base_seed=SEED, num_cpu=2)
+        for p1, p2 in zip(pool_paths, ref_paths):
+            assert np.allclose(p1['actions'], p2['actions'])
+        model = policy.model
+        model.set_transformations(in_shift=model.in_shift.numpy() + 0.1, in_scale=model.in_scale.numpy() * 1.5,
+                                  out_shift=model.out_shift.numpy(), out_scale=model.out_scale.numpy())
+print("Persistent sampler picks up the model transformations")
+
+# several envs per worker built from an env instance should match the serial rollouts
+vec_paths = sample_paths(10, e, policy, base_seed=SEED, envs_per_worker=3)
+ref_paths = sample_paths(10, e, policy, base_seed=SEED)
+for p1, p2 in zip(vec_paths, ref_paths):
+    assert np.allclose(p1['observations'], p2['observations'])
+    assert np.allclose(p1['actions'], p2['actions'])
+with SamplerPool(e, policy, num_cpu=2, envs_per_worker=3) as sampler:
+    pool_paths = sampler.sample_paths(10, base_seed=SEED)
+    for p1, p2 in zip(pool_paths, ref_paths):
+        assert np.allclose(p1['observations'], p2['observations'])
+print("Vectorized rollouts from an env instance match serial rollouts")
+
+# sample_data_batch uses the same seed schedule with every num_cpu and backend
+ref_paths = sample_data_batch(500, 'mjrl_point_mass-v0', policy, base_seed=SEED, num_cpu=1)
+for num_cpu, backend in [(2, 'process'), (2, 'thread')]:
+    paths = sample_data_batch(500, 'mjrl_point_mass-v0', policy, base_seed=SEED, num_cpu=num_cpu, backend=backend)
+    assert len(paths) == len(ref_paths)
+    for p1, p2 in zip(paths, ref_paths):
+        assert np.allclose(p1['actions'], p2['actions'])
+print("sample_data_batch does not depend on num_cpu and backend")